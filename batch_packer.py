@@ -0,0 +1,88 @@
+from cjk_text import is_cjk
+
+try:
+    import tiktoken  # Optional: exact input token counts when installed
+    _encoding = tiktoken.get_encoding("o200k_base")
+except Exception:
+    _encoding = None
+
+# Fixed cost of the system message, instructions and return-format example in every request
+PROMPT_OVERHEAD_TOKENS = 150
+# Each input item is rendered as {'id': N, 'text': '...'} and each output item as "N": "...",
+ITEM_OVERHEAD_TOKENS = 10
+# Rough estimate: Simplified Chinese output costs ~0.45 tokens per English source character
+OUTPUT_TOKENS_PER_SOURCE_CHAR = 0.45
+
+
+def estimate_text_tokens(text):
+    """
+    Estimates how many tokens a piece of text costs as model input.
+    Uses tiktoken when available, otherwise ~4 characters per token (1 per CJK character).
+    """
+    if _encoding is not None:
+        return len(_encoding.encode(text))
+    cjk = sum(1 for character in text if is_cjk(character))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def estimate_segment_tokens(text):
+    """
+    Returns (input tokens, expected output tokens) for translating one segment.
+    """
+    input_tokens = estimate_text_tokens(text) + ITEM_OVERHEAD_TOKENS
+    output_tokens = int(len(text) * OUTPUT_TOKENS_PER_SOURCE_CHAR) + ITEM_OVERHEAD_TOKENS
+    return input_tokens, output_tokens
+
+
+def estimate_batch_tokens(batch):
+    """
+    Estimates total tokens (prompt + expected completion) for one batch of segments.
+    Used by the scheduler to keep the tokens-per-minute budget honest.
+    """
+    total = PROMPT_OVERHEAD_TOKENS
+    for segment in batch:
+        input_tokens, output_tokens = estimate_segment_tokens(segment['text'])
+        total += input_tokens + output_tokens
+    return total
+
+
+def pack_segments(items, input_token_budget=12000, output_token_budget=6000, max_segments=250):
+    """
+    Greedily packs segments into request-sized batches by estimated token cost.
+
+    Segments are kept in document order, so small pages share a request with their
+    neighbours while long pages are split across several requests.
+
+    Args:
+        items (list): (key, segment) pairs in document order; keys are passed through untouched.
+        input_token_budget (int): Maximum estimated prompt tokens per request.
+        output_token_budget (int): Maximum expected completion tokens per request. Keep this well
+            below max_completion_tokens, which also has to cover the model's reasoning tokens.
+        max_segments (int): Hard cap on segments per request.
+
+    Returns:
+        list: Batches, each a list of (key, segment) pairs.
+    """
+    batches = []
+    current = []
+    current_input = PROMPT_OVERHEAD_TOKENS
+    current_output = 0
+
+    for key, segment in items:
+        input_tokens, output_tokens = estimate_segment_tokens(segment['text'])
+        over_budget = (current_input + input_tokens > input_token_budget
+                       or current_output + output_tokens > output_token_budget
+                       or len(current) >= max_segments)
+        if current and over_budget:
+            batches.append(current)
+            current = []
+            current_input = PROMPT_OVERHEAD_TOKENS
+            current_output = 0
+        # An oversized single segment still gets a request of its own
+        current.append((key, segment))
+        current_input += input_tokens
+        current_output += output_tokens
+
+    if current:
+        batches.append(current)
+    return batches
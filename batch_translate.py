@@ -0,0 +1,238 @@
+import argparse
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import main
+from batch_packer import estimate_batch_tokens
+from metrics import configure_logging, write_prometheus
+from page_renderer import create_render_pool
+from storage import get_storage
+from translation_scheduler import TranslationScheduler
+
+logger = logging.getLogger(__name__)
+
+# --- Batch Configuration ---
+# Documents processed at the same time; they share one translation scheduler and one render pool
+documents_in_flight = 2
+# Added to each input's name to form its translated single-document output
+output_suffix = "_zh"
+
+
+def output_name_for(input_name, suffix=None):
+    """
+    Name of the translated document for an input, e.g. "0723.pdf" -> "0723_zh.pdf".
+    """
+    suffix = output_suffix if suffix is None else suffix
+    return f"{os.path.splitext(input_name)[0]}{suffix}.pdf"
+
+
+def discover_documents(inputs, prefix=None, storage_client=None, suffix=None):
+    """
+    Expands the command-line inputs into the list of documents to translate.
+
+    Args:
+        inputs (list): Local PDF files, local directories (every PDF directly inside) or
+            Object Storage object names.
+        prefix (str): Object Storage prefix; every PDF directly under it is added.
+        storage_client: Storage backend used for the prefix listing.
+        suffix (str): Output suffix; inputs that are themselves translated outputs are skipped.
+
+    Returns:
+        list: Document names in a stable order, without duplicates.
+    """
+    suffix = output_suffix if suffix is None else suffix
+    documents = []
+    for name in inputs:
+        if os.path.isdir(name):
+            documents.extend(sorted(
+                os.path.join(name, filename) for filename in os.listdir(name)
+                if filename.lower().endswith(".pdf")
+            ))
+        else:
+            documents.append(name)
+    if prefix is not None:
+        for obj in storage_client.list(prefix=prefix):
+            # Page objects of earlier runs live one folder further down
+            if obj.name.lower().endswith(".pdf") and "/" not in obj.name[len(prefix):].lstrip("/"):
+                documents.append(obj.name)
+    unique = []
+    for name in documents:
+        if name not in unique and not name.endswith(f"{suffix}.pdf"):
+            unique.append(name)
+    return unique
+
+
+def _document_summary(name, status, seconds, report):
+    counters = report["counters"] if report else {}
+    return {
+        "document": name,
+        "status": status,
+        "seconds": seconds,
+        "pages": counters.get("pages", 0),
+        "rendered_pages": counters.get("rendered_pages", 0),
+        "segments": counters.get("segments", 0),
+        "requests": counters.get("requests", 0),
+        "prompt_tokens": counters.get("prompt_tokens", 0),
+        "completion_tokens": counters.get("completion_tokens", 0),
+        "bytes_uploaded": counters.get("bytes_uploaded", 0),
+    }
+
+
+def translate_documents(documents, mode=None, storage_client=None, in_flight=None, regular_font=None,
+                        bold_font=None, suffix=None):
+    """
+    Translates many documents through one shared translation scheduler and render pool.
+
+    Up to `in_flight` documents run at once, so one document's extraction and rendering
+    overlap with another's translation requests, while the scheduler's requests/tokens per
+    minute and concurrency and the render pool's process count stay global limits.
+
+    Args:
+        documents (list): Local paths or Object Storage names, see discover_documents.
+        mode (str): Output mode for every document; defaults to main.output_mode.
+        storage_client: Storage backend; defaults to main.storage_backend.
+        in_flight (int): Documents processed concurrently; defaults to documents_in_flight.
+        regular_font (str): Regular CJK font; defaults to main.font_path_regular.
+        bold_font (str): Bold CJK font; defaults to main.font_path_bold.
+        suffix (str): Output suffix for the single-document outputs.
+
+    Returns:
+        list: One summary dict per document, in input order.
+
+    When main.prometheus_textfile is set, the documents' reports are written to it together
+    once the batch ends, instead of each document overwriting the others'.
+    """
+    storage_client = storage_client or get_storage(main.storage_backend)
+    in_flight = max(1, in_flight or documents_in_flight)
+    regular_font = regular_font or main.font_path_regular
+    bold_font = bold_font or main.font_path_bold
+    if not os.path.exists(bold_font):
+        # The shared render workers load the fonts once, so fall back before starting them
+        bold_font = regular_font
+
+    scheduler = TranslationScheduler(
+        main.translate_batch_with_openai,
+        max_in_flight=main.translation_concurrency,
+        requests_per_minute=main.requests_per_minute,
+        tokens_per_minute=main.tokens_per_minute,
+        token_estimator=estimate_batch_tokens,
+        max_partial_retries=main.max_partial_retries,
+    )
+    render_pool = None
+    if main.render_workers > 1:
+        render_pool = create_render_pool(main.render_workers, regular_font, bold_font,
+                                         main.text_removal, main.source_recycle_interval)
+
+    def run_document(name):
+        start = time.perf_counter()
+        try:
+            report = main.translate_pdf_with_bolding(name, output_name_for(name, suffix), regular_font, bold_font,
+                                                     mode=mode, storage_client=storage_client,
+                                                     scheduler=scheduler, render_pool=render_pool,
+                                                     export_prometheus=False)
+            # "skipped" when there was nothing left to do, "failed" if the input, fonts or some output failed
+            status = report["status"]
+        except Exception as e:
+            logger.error(f"❌ {name}: {e}")
+            report, status = None, "failed"
+        return _document_summary(name, status, time.perf_counter() - start, report), report
+
+    logger.info(f"📚 Translating {len(documents)} documents, {in_flight} at a time, with "
+                f"{main.translation_concurrency} requests in flight and {main.render_workers} render process(es)")
+    summaries = {}
+    reports = {}
+    try:
+        with ThreadPoolExecutor(max_workers=in_flight, thread_name_prefix="document") as executor:
+            futures = {executor.submit(run_document, name): name for name in documents}
+            for finished, future in enumerate(as_completed(futures), 1):
+                name = futures[future]
+                summaries[name], reports[name] = future.result()
+                summary = summaries[name]
+                logger.info(f"📘 [{finished}/{len(documents)}] {summary['document']}: {summary['status']}, "
+                            f"{summary['pages']} pages, {summary['segments']} segments in {summary['seconds']:.1f}s")
+    finally:
+        scheduler.shutdown()
+        if render_pool is not None:
+            render_pool.shutdown()
+    if main.prometheus_textfile:
+        _write_batch_prometheus(main.prometheus_textfile,
+                                [reports[name] for name in documents if reports[name] is not None])
+    return [summaries[name] for name in documents]
+
+
+def _write_batch_prometheus(path, reports):
+    try:
+        write_prometheus(path, reports)
+        logger.info(f"📝 Prometheus metrics for {len(reports)} documents written to {path}")
+    except Exception as e:
+        logger.warning(f"⚠️ Could not write run metrics: {e}")
+
+
+def log_batch_summary(summaries, elapsed):
+    """
+    Logs one line per document and the totals for the whole batch.
+    """
+    logger.info("=" * 50)
+    for summary in summaries:
+        logger.info(f"   {summary['status']:>7}  {summary['document']}: {summary['pages']} pages, "
+                    f"{summary['requests']} requests, {summary['seconds']:.1f}s")
+    pages = sum(summary["pages"] for summary in summaries)
+    counts = {}
+    for summary in summaries:
+        counts[summary["status"]] = counts.get(summary["status"], 0) + 1
+    tokens = sum(summary["prompt_tokens"] + summary["completion_tokens"] for summary in summaries)
+    logger.info(f"📊 {len(summaries)} documents ({counts}), {pages} pages in {elapsed:.1f}s "
+                f"({pages / elapsed if elapsed else 0:.2f} pages/s), {tokens} tokens")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Translate many magazine PDFs through one shared translation and render pool.")
+    parser.add_argument("inputs", nargs="*",
+                        help="PDF files, local directories of PDFs, or Object Storage object names")
+    parser.add_argument("--prefix", help="Object Storage prefix; translates every PDF directly under it")
+    parser.add_argument("--mode", choices=("single", "pages", "both"), default=main.output_mode,
+                        help="output mode for every document (default: %(default)s)")
+    parser.add_argument("--documents", type=int, default=documents_in_flight,
+                        help="documents processed at the same time (default: %(default)s)")
+    parser.add_argument("--translation-concurrency", type=int, default=main.translation_concurrency,
+                        help="translation requests in flight across all documents (default: %(default)s)")
+    parser.add_argument("--render-workers", type=int, default=main.render_workers,
+                        help="render processes shared by all documents (default: %(default)s)")
+    parser.add_argument("--storage", choices=("replit", "local", "memory"), default=main.storage_backend,
+                        help="storage backend (default: the STORAGE_BACKEND environment variable)")
+    parser.add_argument("--suffix", default=output_suffix,
+                        help="suffix of each translated document's name (default: %(default)s)")
+    parser.add_argument("--summary-json", help="also write the per-document summary to this JSON file")
+    parser.add_argument("--log-level", default=main.log_level, help="logging level (default: %(default)s)")
+    args = parser.parse_args(argv)
+    if not args.inputs and args.prefix is None:
+        parser.error("give at least one input file or directory, or --prefix")
+    return args
+
+
+# --- Run the batch ---
+if __name__ == "__main__":
+    args = parse_args()
+    configure_logging(args.log_level)
+    main.translation_concurrency = args.translation_concurrency
+    main.render_workers = args.render_workers
+    batch_storage = get_storage(args.storage)
+
+    batch_documents = discover_documents(args.inputs, args.prefix, batch_storage, args.suffix)
+    if not batch_documents:
+        logger.error("❌ No PDF documents found to translate")
+        raise SystemExit(1)
+
+    batch_start = time.perf_counter()
+    batch_summaries = translate_documents(batch_documents, mode=args.mode, storage_client=batch_storage,
+                                          in_flight=args.documents, suffix=args.suffix)
+    log_batch_summary(batch_summaries, time.perf_counter() - batch_start)
+    if args.summary_json:
+        with open(args.summary_json, "w") as f:
+            json.dump(batch_summaries, f, indent=2)
+    if any(summary["status"] == "failed" for summary in batch_summaries):
+        raise SystemExit(1)
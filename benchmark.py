@@ -0,0 +1,361 @@
+import ast
+import fitz  # PyMuPDF
+import json
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from openai import OpenAI
+
+# Every request goes to the local stub server, so no real key is needed to import main
+os.environ.setdefault("OPENAI_API_KEY", "benchmark-stub")
+import main
+import merge_pdfs
+from merge_pdfs import _peak_rss_mb
+from metrics import configure_logging
+from storage import LocalStorage, MemoryStorage
+
+# --- Benchmark Configuration ---
+# Each scenario is one synthetic magazine run end to end; keys override generate_synthetic_pdf()
+# and run_benchmark() defaults
+benchmark_scenarios = [
+    {"name": "small", "pages": 8, "spans_per_page": 30},
+    {"name": "magazine", "pages": 60, "spans_per_page": 80, "image_only_every": 10},
+]
+# Seconds the stub translation server waits before answering each request
+stub_latency = 0.5
+# "memory" keeps every object in RAM, "local" writes them under a temporary directory
+benchmark_storage = "memory"
+# Folder the JSON results are written to, one file per benchmark run
+benchmark_results_dir = "benchmark_results"
+# Log level for the pipeline's own output while benchmarking
+benchmark_log_level = "WARNING"
+# Run every scenario in a fresh process, so its peak memory is its own rather than the
+# largest peak of any scenario before it (ru_maxrss never goes down within a process)
+isolate_scenarios = True
+
+SAMPLE_WORDS = (
+    "the issue feature story interview photography summer collection studio portrait city night "
+    "design culture travel editor letter season cover exclusive behind scenes style music film"
+).split()
+
+
+def generate_synthetic_pdf(path, pages=20, spans_per_page=40, font_sizes=(8, 9, 10, 12, 18, 28),
+                           bold_ratio=0.2, color_ratio=0.2, image_only_every=0, seed=0):
+    """
+    Writes a magazine-like PDF: a repeated running header and footer, headlines and body
+    lines in mixed sizes, some bold or coloured, over a full-page background image.
+
+    Args:
+        path (str): Where to save the PDF.
+        pages (int): Number of pages.
+        spans_per_page (int): Text lines per page, including the header and footer.
+        font_sizes (tuple): Sizes picked from at random for each line.
+        bold_ratio (float): Fraction of lines set in bold.
+        color_ratio (float): Fraction of lines set in a colour instead of black.
+        image_only_every (int): Make every Nth page a scanned-style page with no text (0 = never).
+        seed (int): Random seed, so the same arguments always produce the same document.
+
+    Returns:
+        int: Number of text spans written.
+    """
+    rng = random.Random(seed)
+    colors = [(0.8, 0.1, 0.1), (0.1, 0.3, 0.7), (0.2, 0.5, 0.2)]
+    doc = fitz.open()
+    spans = 0
+    # One small background image shared by every page, like a textured magazine paper
+    background = fitz.Pixmap(fitz.csRGB, fitz.IRect(0, 0, 64, 64), False)
+    background.set_rect(background.irect, (245, 240, 230))
+    for x in range(0, 64, 8):
+        background.set_rect(fitz.IRect(x, 0, x + 4, 64), (235, 228, 215))
+    background_png = background.tobytes("png")
+
+    for page_num in range(pages):
+        page = doc.new_page(width=595, height=842)
+        page.insert_image(page.rect, stream=background_png)
+        if image_only_every and (page_num + 1) % image_only_every == 0:
+            continue
+
+        y = 50
+        lines = [("MAGAZINE · SUMMER ISSUE", 9, False, (0, 0, 0))]
+        for _ in range(max(0, spans_per_page - 2)):
+            size = rng.choice(font_sizes)
+            words = " ".join(rng.choice(SAMPLE_WORDS) for _ in range(rng.randint(2, 12)))
+            bold = rng.random() < bold_ratio
+            color = rng.choice(colors) if rng.random() < color_ratio else (0, 0, 0)
+            lines.append((words.capitalize(), size, bold, color))
+        for text, size, bold, color in lines:
+            if y + size > 800:
+                break
+            page.insert_text((50, y + size), text, fontname="hebo" if bold else "helv",
+                             fontsize=size, color=color)
+            y += size * 1.4
+            spans += 1
+        page.insert_text((50, 820), f"Page {page_num + 1}", fontname="helv", fontsize=8)
+        spans += 1
+
+    doc.save(path, garbage=4, deflate=True)
+    doc.close()
+    return spans
+
+
+class _StubTranslationHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        if not self.path.endswith("/chat/completions"):
+            self.send_error(404)
+            return
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        time.sleep(self.server.latency)
+        with self.server.lock:
+            self.server.requests += 1
+
+        # The prompt embeds the input list as a Python literal after "Input texts:"
+        prompt = request["messages"][-1]["content"]
+        body = prompt.split("Input texts:", 1)[1].split("Return format:", 1)[0].strip()
+        items = ast.literal_eval(body)
+        content = json.dumps({str(item["id"]): f"[zh] {item['text']}" for item in items}, ensure_ascii=False)
+        prompt_tokens = sum(len(message["content"]) for message in request["messages"]) // 4
+        completion_tokens = len(content) // 2
+
+        payload = json.dumps({
+            "id": f"chatcmpl-stub-{self.server.requests}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model", "stub"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop",
+            }],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            },
+        }).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass  # Keep the benchmark output readable
+
+
+class StubTranslationServer:
+    """
+    Local OpenAI-compatible chat completions endpoint that "translates" by tagging the input.
+
+    Requests go through the real OpenAI client and HTTP stack, so connection handling and
+    JSON parsing are part of the measurement; only the model time is replaced by `latency`.
+
+    Args:
+        latency (float): Seconds to wait before answering each request.
+    """
+
+    def __init__(self, latency=0.5):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), _StubTranslationHandler)
+        self.server.daemon_threads = True
+        self.server.latency = latency
+        self.server.lock = threading.Lock()
+        self.server.requests = 0
+        self._thread = threading.Thread(target=self.server.serve_forever, name="stub-openai", daemon=True)
+
+    @property
+    def base_url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    @property
+    def requests(self):
+        return self.server.requests
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def _benchmark_fonts(temp_dir):
+    """
+    Uses the configured CJK fonts if present, otherwise PyMuPDF's built-in CJK font.
+    """
+    if os.path.exists(main.font_path_regular):
+        bold = main.font_path_bold if os.path.exists(main.font_path_bold) else main.font_path_regular
+        return main.font_path_regular, bold
+    font_path = os.path.join(temp_dir, "builtin-cjk.ttf")
+    with open(font_path, "wb") as f:
+        f.write(fitz.Font("cjk").buffer)
+    return font_path, font_path
+
+
+def run_benchmark(name="synthetic", pages=20, spans_per_page=40, latency=None, storage=None,
+                  render_workers=None, mode="both", **pdf_options):
+    """
+    Runs the translation and merge pipeline on one synthetic PDF against the stub server.
+
+    Args:
+        name (str): Scenario name, used for the object names and in the results.
+        pages (int): Pages in the synthetic PDF.
+        spans_per_page (int): Text lines per page.
+        latency (float): Stub server latency per request; defaults to stub_latency.
+        storage (str): "memory" or "local"; defaults to benchmark_storage.
+        render_workers (int): Render processes; defaults to main.render_workers.
+        mode (str): Output mode passed to translate_pdf_with_bolding ("both" also feeds the merge).
+        **pdf_options: Extra generate_synthetic_pdf() arguments (font_sizes, bold_ratio, ...).
+
+    Returns:
+        dict: Throughput, per-stage seconds and peak memory. peak_rss_mb is the peak of the
+        whole calling process, so it only belongs to this scenario when run in a fresh process
+        (see isolate_scenarios).
+    """
+    latency = stub_latency if latency is None else latency
+    storage = storage or benchmark_storage
+    results = {
+        "name": name, "pages": pages, "spans_per_page": spans_per_page, "latency": latency,
+        "storage": storage, "mode": mode, "render_workers": render_workers or main.render_workers,
+        "pdf_options": pdf_options,
+    }
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        regular_font, bold_font = _benchmark_fonts(temp_dir)
+        storage_client = LocalStorage(os.path.join(temp_dir, "storage")) if storage == "local" else MemoryStorage()
+
+        generate_start = time.perf_counter()
+        source_path = os.path.join(temp_dir, f"{name}.pdf")
+        results["spans"] = generate_synthetic_pdf(source_path, pages=pages, spans_per_page=spans_per_page,
+                                                  **pdf_options)
+        # The input is read from storage, like a magazine uploaded to the bucket
+        input_name = f"benchmark_{name}.pdf"
+        storage_client.upload_from_filename(input_name, source_path)
+        results["source_bytes"] = os.path.getsize(source_path)
+        results["generate_seconds"] = time.perf_counter() - generate_start
+
+        saved_settings = (main.client, main.translation_cache_path, main.render_workers,
+                          main.metrics_report_dir, merge_pdfs.metrics_report_dir)
+        with StubTranslationServer(latency) as stub:
+            main.client = OpenAI(base_url=stub.base_url, api_key="benchmark-stub", max_retries=0)
+            main.translation_cache_path = None
+            if render_workers:
+                main.render_workers = render_workers
+            # The benchmark keeps the reports in its own results file
+            main.metrics_report_dir = merge_pdfs.metrics_report_dir = None
+            try:
+                translate_start = time.perf_counter()
+                report = main.translate_pdf_with_bolding(input_name, f"benchmark_{name}_zh.pdf",
+                                                         regular_font, bold_font, mode=mode,
+                                                         storage_client=storage_client)
+                translate_seconds = time.perf_counter() - translate_start
+                merge_report = None
+                if mode in ("pages", "both"):
+                    merge_report = merge_pdfs.merge_pdfs_from_folder(f"benchmark_{name}",
+                                                                     storage_client=storage_client)
+            finally:
+                (main.client, main.translation_cache_path, main.render_workers,
+                 main.metrics_report_dir, merge_pdfs.metrics_report_dir) = saved_settings
+            results["stub_requests"] = stub.requests
+
+    if report["status"] != "done":
+        raise RuntimeError(f"Benchmark '{name}' did not run the pipeline to completion ({report['status']})")
+    counters = report["counters"]
+    results.update({
+        "segments": counters["segments"],
+        "unique_segments": counters["unique_segments"],
+        "translated_segments": counters["translated_segments"],
+        "requests": counters["requests"],
+        "prompt_tokens": counters.get("prompt_tokens", 0),
+        "completion_tokens": counters.get("completion_tokens", 0),
+        "translate_seconds": translate_seconds,
+        "pages_per_second": counters["pages"] / translate_seconds,
+        "segments_per_second": counters["segments"] / translate_seconds,
+        "stage_seconds": {stage: totals["seconds"] for stage, totals in report["stages"].items()},
+        "bytes_uploaded": counters["bytes_uploaded"],
+    })
+    if merge_report:
+        results["merge_seconds"] = merge_report["elapsed"]
+        results["merge_pages_per_second"] = merge_report["counters"]["pages"] / merge_report["elapsed"]
+        results["merge_stage_seconds"] = {stage: totals["seconds"] for stage, totals in merge_report["stages"].items()}
+    results["peak_rss_mb"] = _peak_rss_mb()
+    # Render worker processes are only counted once they have exited
+    results["peak_rss_children_mb"] = _peak_rss_mb(resource.RUSAGE_CHILDREN)
+    return results
+
+
+def _run_isolated(scenario):
+    """
+    Runs one scenario in a new spawned process and returns its results.
+    """
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=1, mp_context=context, initializer=configure_logging,
+                             initargs=(benchmark_log_level,)) as executor:
+        return executor.submit(run_benchmark, **scenario).result()
+
+
+def run_benchmark_suite(scenarios=None, results_dir=None, isolate=None):
+    """
+    Runs every scenario, prints a summary line for each and saves all results as one JSON file.
+
+    Args:
+        scenarios (list): Scenario dicts; defaults to benchmark_scenarios.
+        results_dir (str): Where to write the results; defaults to benchmark_results_dir.
+        isolate (bool): One fresh process per scenario; defaults to isolate_scenarios.
+
+    Returns:
+        str: Path of the JSON results file.
+    """
+    scenarios = scenarios or benchmark_scenarios
+    results_dir = results_dir or benchmark_results_dir
+    isolate = isolate_scenarios if isolate is None else isolate
+    report = {
+        "started": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "environment": {
+            "python": platform.python_version(),
+            "pymupdf": fitz.VersionBind,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+        },
+        "scenarios": [],
+    }
+
+    print(f"🧪 Running {len(scenarios)} benchmark scenario(s) against a stub server ({stub_latency}s latency)")
+    for scenario in scenarios:
+        scenario = dict(scenario)
+        # Passed explicitly so a spawned process sees the same settings as this one
+        scenario.setdefault("latency", stub_latency)
+        scenario.setdefault("storage", benchmark_storage)
+        if isolate:
+            result = _run_isolated(scenario)
+        else:
+            result = run_benchmark(**scenario)
+        result["isolated"] = isolate
+        report["scenarios"].append(result)
+        stages = ", ".join(f"{stage} {seconds:.2f}s" for stage, seconds in result["stage_seconds"].items())
+        print(f"📊 {result['name']:>10}: {result['pages']} pages, {result['segments']} segments in "
+              f"{result['translate_seconds']:.1f}s -> {result['pages_per_second']:.2f} pages/s, "
+              f"{result['segments_per_second']:.1f} segments/s, "
+              f"{'peak' if isolate else 'cumulative process peak'} RSS {result['peak_rss_mb']:.0f} MB")
+        print(f"   stages: {stages}" + (f", merge {result['merge_seconds']:.2f}s" if "merge_seconds" in result else ""))
+
+    os.makedirs(results_dir, exist_ok=True)
+    results_path = os.path.join(results_dir, f"benchmark_{time.strftime('%Y%m%d_%H%M%S')}.json")
+    with open(results_path, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"💾 Results saved to {results_path}")
+    return results_path
+
+
+# --- Run the benchmark suite ---
+if __name__ == "__main__":
+    configure_logging(benchmark_log_level)
+    run_benchmark_suite()
@@ -0,0 +1,33 @@
+def is_han(character):
+    """
+    True for Han ideographs, the characters that identify Chinese text.
+    """
+    code = ord(character)
+    return (0x4E00 <= code <= 0x9FFF      # CJK unified ideographs
+            or 0x3400 <= code <= 0x4DBF   # Extension A
+            or 0xF900 <= code <= 0xFAFF   # CJK compatibility ideographs
+            or 0x20000 <= code <= 0x2FA1F)  # Extensions B onwards, compatibility supplement
+
+
+def is_cjk(character):
+    """
+    True for any CJK character: Han, radicals, CJK punctuation, kana, bopomofo, Hangul and
+    full-width forms. Each can be wrapped on its own and costs about one token.
+    """
+    code = ord(character)
+    return (0x2E80 <= code <= 0x9FFF      # Radicals, punctuation, kana, bopomofo, unified ideographs
+            or 0xAC00 <= code <= 0xD7AF   # Hangul syllables
+            or 0xF900 <= code <= 0xFAFF   # CJK compatibility ideographs
+            or 0xFF00 <= code <= 0xFFEF   # Full-width forms
+            or 0x20000 <= code <= 0x2FA1F)
+
+
+def han_share(text):
+    """
+    Fraction of the letters in text that are Han ideographs (0.0 if it has no letters).
+    Kana and Hangul count as letters but not as Han, so Japanese or Korean text scores low.
+    """
+    letters = [character for character in text if character.isalpha()]
+    if not letters:
+        return 0.0
+    return sum(1 for character in letters if is_han(character)) / len(letters)
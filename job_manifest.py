@@ -0,0 +1,137 @@
+import hashlib
+import json
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def page_content_hash(doc, page_num):
+    """
+    Hashes what a page looks like in the source: its size, content streams, the streams of
+    the Form XObjects it draws (get_xobjects walks nested forms too) and image data.
+    """
+    page = doc[page_num]
+    digest = hashlib.sha256()
+    digest.update(repr(tuple(page.rect)).encode())
+    digest.update(page.read_contents())
+    xrefs = [xobject[0] for xobject in page.get_xobjects()]
+    xrefs += [image[0] for image in page.get_images(full=True)]
+    for xref in dict.fromkeys(xrefs):
+        digest.update(doc.xref_stream_raw(xref) or b"")
+    return digest.hexdigest()
+
+
+def document_content_hash(page_hashes):
+    """
+    Combines the page hashes into one hash of the whole source document.
+    """
+    return hashlib.sha256("".join(page_hashes).encode()).hexdigest()
+
+
+class JobManifest:
+    """
+    Per-page progress of one translation job, stored as JSON next to the job's outputs.
+
+    Each page records the hash of its source content, its translation/upload state and the
+    object it was uploaded to, so a rerun can skip finished pages, retry failed ones and
+    redo pages whose source changed.
+
+    Page states: "pending", "translated", "partial" (some segments untranslated),
+    "uploaded" and "failed". Page entries only describe the page's own page_NNN.pdf object;
+    single-document outputs are recorded separately under "documents", keyed by object name,
+    so a run in one output mode never takes another mode's output for its own.
+    """
+
+    def __init__(self, storage_client, object_name, source_name):
+        self.storage_client = storage_client
+        self.object_name = object_name
+        self.data = {"source": source_name, "pages": {}, "documents": {}}
+        # Pages are marked from the background upload threads as well as the main thread
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, storage_client, object_name, source_name):
+        """
+        Loads an existing manifest from storage, or starts an empty one.
+        """
+        manifest = cls(storage_client, object_name, source_name)
+        try:
+            if storage_client.exists(object_name):
+                manifest.data = json.loads(storage_client.download_as_text(object_name))
+                manifest.data.setdefault("pages", {})
+                manifest.data.setdefault("documents", {})
+        except Exception as e:
+            logger.warning(f"⚠️ Could not read job manifest '{object_name}', starting fresh: {e}")
+        return manifest
+
+    def page(self, page_num):
+        return self.data["pages"].get(str(page_num + 1), {})
+
+    def is_complete(self, page_num, source_hash, object_name):
+        """
+        True if the page was fully translated and uploaded as `object_name` from identical source content.
+        """
+        entry = self.page(page_num)
+        return (entry.get("state") == "uploaded"
+                and entry.get("source_hash") == source_hash
+                and entry.get("object") == object_name
+                and not entry.get("untranslated"))
+
+    def mark(self, page_num, state, source_hash, **fields):
+        """
+        Updates one page's entry; extra fields (object, untranslated, error) are stored as given.
+        """
+        with self._lock:
+            entry = self.data["pages"].setdefault(str(page_num + 1), {})
+            if entry.get("source_hash") != source_hash:
+                # Source changed (or first time seen): forget everything recorded for the old content
+                entry.clear()
+            entry.update(fields)
+            entry["source_hash"] = source_hash
+            entry["state"] = state
+            entry["updated"] = time.time()
+
+    def document(self, object_name):
+        return self.data["documents"].get(object_name, {})
+
+    def is_document_complete(self, object_name, page_hashes):
+        """
+        True if the single-document output `object_name` was fully translated and uploaded
+        from a source whose pages all hash the same as now.
+        """
+        entry = self.document(object_name)
+        return (entry.get("state") == "uploaded"
+                and entry.get("source_hash") == document_content_hash(page_hashes)
+                and not entry.get("untranslated"))
+
+    def mark_document(self, object_name, state, page_hashes, **fields):
+        """
+        Records the state of a single-document output; extra fields (untranslated, error) are stored as given.
+        """
+        with self._lock:
+            self.data["documents"][object_name] = dict(
+                fields, source_hash=document_content_hash(page_hashes), state=state, updated=time.time())
+
+    def counts(self):
+        """
+        Returns {state: number of pages}.
+        """
+        totals = {}
+        with self._lock:
+            for entry in self.data["pages"].values():
+                state = entry.get("state", "pending")
+                totals[state] = totals.get(state, 0) + 1
+        return totals
+
+    def save(self):
+        """
+        Writes the manifest back to storage.
+        """
+        with self._lock:
+            text = json.dumps(self.data, indent=1)
+        try:
+            self.storage_client.upload_from_text(self.object_name, text)
+        except Exception as e:
+            logger.warning(f"⚠️ Could not save job manifest '{self.object_name}': {e}")
@@ -1,30 +1,147 @@
 import fitz  # PyMuPDF
+import functools
+import json
+import logging
 import os
+import tempfile
+import threading
 import time
-from openai import OpenAI
-from replit.object_storage import Client
+from openai import OpenAI, RateLimitError
+from batch_packer import estimate_batch_tokens, pack_segments
+from cjk_text import han_share
+from job_manifest import JobManifest, page_content_hash
+from metrics import RunMetrics, configure_logging
+from page_renderer import AssembledDocument, SourceDocument, copy_page, mupdf_lock, render_pages
+from segment_table import SegmentTable
+from storage import FolderIndex, UploadQueue, get_storage
+from translation_cache import TranslationCache
+from translation_scheduler import TranslationScheduler, TruncatedResponseError
+
+logger = logging.getLogger(__name__)
 
 # --- Configuration ---
 # 1. Name of the PDF you want to translate
 input_pdf = "0723.pdf.pdf"
 # 2. Name for the new, translated PDF
 output_pdf = "0723zh.pdf"
+# Where translated pages go: "pages" writes page_NNN.pdf files for merge_pdfs.py,
+# "single" writes one document named output_pdf instead, "both" does both
+output_mode = "pages"
+# Skip pages a previous run already finished (tracked in <output folder>/manifest.json)
+resume_jobs = True
+# Save the manifest after every N finished pages
+manifest_save_interval = 5
 # 3. Name of the REGULAR font file
 font_path_regular = "NotoSansSC-Regular.ttf"
 # 4. Name of the BOLD font file
 font_path_bold = "NotoSansSC-Bold.ttf"
 
+# --- Extraction ---
+# How spans are grouped into segments: "span", "line" or "block" (paragraph-level)
+segment_grouping = "block"
+
+# --- Passthrough ---
+# Copy pages without translatable text (full-page photos, ads) straight from the source
+passthrough_text_free_pages = True
+# Also copy pages whose text is already in the target language, judged by the share of
+# Han ideographs among the page's letters (the target language is Chinese; kana and
+# Hangul do not count, so Japanese and Korean pages are still translated)
+passthrough_translated_pages = True
+translated_page_han_share = 0.8
+
+# --- Storage ---
+# "replit", "local" or "memory"; None uses the STORAGE_BACKEND environment variable (default "replit")
+storage_backend = None
+# Page uploads run in the background while the next pages render
+upload_queue_depth = 8
+upload_workers = 2
+upload_retries = 3
+
+# --- Translation Scheduling ---
+# Number of translation batches kept in flight at once (1 = strictly sequential)
+translation_concurrency = 8
+# Account budgets for the model; None disables the limit
+requests_per_minute = 500
+tokens_per_minute = 200000
+# Requests are packed by estimated token cost rather than a fixed segment count.
+# The output budget stays well under max_completion_tokens, which also covers reasoning tokens.
+max_completion_tokens = 19000
+batch_input_token_budget = 12000
+batch_output_token_budget = 6000
+max_segments_per_batch = 250
+# Extra requests per batch for re-requesting missing ids or splitting truncated responses
+max_partial_retries = 4
+
+# --- Rendering ---
+# Number of processes rendering pages in parallel (1 renders in the main process)
+render_workers = os.cpu_count() or 1
+# How the original text is removed: "redact" strips it from the page's content stream,
+# "cover" re-embeds the page and paints a white box over every segment (the old behaviour)
+text_removal = "redact"
+# Reopen the source PDF every N pages and empty MuPDF's object store, so the decoded fonts
+# and images of a very large issue do not pile up in memory (0 keeps it open throughout)
+source_recycle_interval = 25
+# In "single"/"both" mode, merge the fonts every rendered page brings along every N pages
+# by compacting the output document to a temporary file (0 keeps every copy in memory until the end)
+single_compact_interval = 20
+
+# --- Logging & Metrics ---
+# "INFO" shows one line per phase, "DEBUG" adds per-page and per-segment detail
+log_level = "INFO"
+# Local folder for the per-run JSON report (None to disable)
+metrics_report_dir = "run_reports"
+# Prometheus text file for node_exporter's textfile collector, e.g. "/var/lib/node_exporter/magazine_refit.prom"
+prometheus_textfile = None
+
+# --- Translation Cache ---
+# On-disk translation memory shared across runs (set to None to disable)
+translation_cache_path = "translation_cache.sqlite3"
+translation_cache_max_entries = 200000
+
 # --- OpenAI Configuration ---
 # Initialize the OpenAI client
 # It's recommended to set your API key as an environment variable or use Replit secrets.
 # Example: client = OpenAI(api_key="YOUR_API_KEY")
 # If OPENAI_API_KEY is set as a secret in Replit, this will automatically use it.
 client = OpenAI()
+openai_model = "gpt-5-mini-2025-08-07"
+target_language = "Simplified Chinese"
+# Bump whenever the prompt below changes so stale cached translations are not reused
+prompt_version = 1
+
+# Opened on first use, so importing this module never creates the database file
+translation_cache = None
+_translation_cache_lock = threading.Lock()
+
+def get_translation_cache():
+    """
+    Returns the shared TranslationCache, opening it on first use (None if translation_cache_path is None).
+    """
+    global translation_cache
+    with _translation_cache_lock:
+        if translation_cache is None and translation_cache_path:
+            translation_cache = TranslationCache(
+                translation_cache_path,
+                target_language=target_language,
+                model=openai_model,
+                prompt_version=prompt_version,
+                max_entries=translation_cache_max_entries,
+            )
+        return translation_cache
 
-def translate_batch_with_openai(text_segments):
+def translate_batch_with_openai(text_segments, openai_client=None, cache=None, metrics=None, cache_lookup=True):
     """
     Translates multiple text segments in one API call using JSON format.
+    Segments already in the translation cache are not sent to the API (cache=False bypasses it);
+    with cache_lookup=False the caller has already consulted the cache and new translations are only stored.
+    Rate limit errors are re-raised so the scheduler can back off and retry, and a
+    response cut off at the token limit raises TruncatedResponseError so it can split the batch.
+    If a RunMetrics is given, cache hits, request time and the response's token usage are added to it.
     """
+    openai_client = openai_client or client
+    if cache is None:
+        cache = get_translation_cache()
+    cached = {}
     try:
         # Create a list of texts with IDs for mapping back
         texts_to_translate = []
@@ -38,297 +155,596 @@ def translate_batch_with_openai(text_segments):
         if not texts_to_translate:
             return {}
         
+        # Consult the translation memory before building the prompt
+        if cache and cache_lookup:
+            hits = cache.get_many([item["text"] for item in texts_to_translate])
+            for item in texts_to_translate:
+                if item["text"] in hits:
+                    cached[str(item["id"])] = hits[item["text"]]
+            texts_to_translate = [item for item in texts_to_translate if str(item["id"]) not in cached]
+            if metrics is not None:
+                metrics.count('cache_hits', len(cached))
+            if not texts_to_translate:
+                logger.debug(f"      - All {len(cached)} segments served from translation cache")
+                return cached
+        
         # Create the prompt for batch translation
-        prompt = f"""Translate the following texts to Simplified Chinese. Return the result as a JSON object where each key is the "id" and the value is the translated text.
+        prompt = f"""Translate the following texts to {target_language}. Return the result as a JSON object where each key is the "id" and the value is the translated text.
 
 Input texts:
 {texts_to_translate}
 
 Return format: {{"0": "translated text 1", "1": "translated text 2", ...}}"""
         
-        response = client.chat.completions.create(
-            model="gpt-5-mini-2025-08-07",
+        request_start = time.perf_counter()
+        response = openai_client.chat.completions.create(
+            model=openai_model,
             messages=[
-                {"role": "system", "content": "You are a helpful assistant that translates text to Simplified Chinese. Always respond with valid JSON."},
+                {"role": "system", "content": f"You are a helpful assistant that translates text to {target_language}. Always respond with valid JSON."},
                 {"role": "user", "content": prompt}
             ],
-            max_completion_tokens=19000,  # Increased significantly for large batches
+            max_completion_tokens=max_completion_tokens,
             response_format={"type": "json_object"}
         )
+        if metrics is not None:
+            metrics.add_time('api_request', time.perf_counter() - request_start)
+            metrics.add_usage(getattr(response, 'usage', None))
         
-        import json
         response_content = response.choices[0].message.content
         
         # Debug: print response length and preview
-        print(f"      - API response length: {len(response_content) if response_content else 0}")
-        if not response_content:
-            print("      - Empty response from OpenAI API - likely token limit exceeded")
-            return {}
+        logger.debug(f"      - API response length: {len(response_content) if response_content else 0}")
+        if response.choices[0].finish_reason == "length" or not response_content:
+            logger.debug(f"      - Response for {len(texts_to_translate)} segments hit the token limit")
+            raise TruncatedResponseError(f"{len(texts_to_translate)} segments")
             
         if len(response_content) < 100:
-            print(f"      - Short response content: {response_content}")
+            logger.debug(f"      - Short response content: {response_content}")
         
         translations = json.loads(response_content)
-        print(f"      - Successfully parsed {len(translations)} translations")
+        logger.debug(f"      - Successfully parsed {len(translations)} translations")
+        
+        # Populate the translation memory from this response
+        if cache:
+            source_by_id = {str(item["id"]): item["text"] for item in texts_to_translate}
+            cache.put_many({
+                source_by_id[key]: value
+                for key, value in translations.items()
+                if key in source_by_id and isinstance(value, str) and value
+            })
+        translations.update(cached)
         return translations
         
+    except (RateLimitError, TruncatedResponseError):
+        raise
     except json.JSONDecodeError as e:
-        print(f"      - JSON decode error: {e}")
-        print(f"      - Response content preview: {response.choices[0].message.content[:200] if response.choices[0].message.content else 'None'}")
-        return {}
+        logger.warning(f"      - JSON decode error: {e}")
+        logger.debug(f"      - Response content preview: {response.choices[0].message.content[:200] if response.choices[0].message.content else 'None'}")
+        return cached
     except Exception as e:
-        print(f"      - Batch OpenAI translation failed: {e}")
-        return {}
+        logger.warning(f"      - Batch OpenAI translation failed: {e}")
+        return cached
+
+def _span_style(span):
+    """
+    Styling that must match for spans to share one segment: size, color and bold flag.
+    """
+    return (round(span["size"], 1), span["color"], bool(span['flags'] & 16))
+
+def _glyph_core(span, line):
+    """
+    A band through the middle of a span's glyphs, 0.3 to 0.6 of the font size above the baseline.
+    Redacting only this band removes the span's text without touching the next or previous line,
+    whose glyph boxes overlap this line's bbox when the leading is tight.
+    """
+    if tuple(line["dir"]) != (1, 0):
+        return fitz.Rect(span["bbox"])  # Rotated text: no simple baseline to measure from
+    baseline = span["origin"][1]
+    return fitz.Rect(span["bbox"][0], baseline - 0.6 * span["size"],
+                     span["bbox"][2], baseline - 0.3 * span["size"])
+
+def extract_text_segments(page, grouping=None):
+    """
+    Collects the text on a page with the styling needed to re-render it.
 
-def translate_pdf_with_bolding(input_path, output_path, regular_font, bold_font):
+    With grouping "line", adjacent spans on the same line that share size, color and
+    bold flag become one segment; "block" also joins consecutive lines of the same block
+    that are each entirely in one shared style, so a paragraph is translated and rendered
+    as one unit. A line mixing styles (an inline bold or coloured word) is grouped by line,
+    since a segment spanning it would cover its neighbours' rects.
+    "span" keeps every span separate. Each segment's rect is the union of its spans.
+    """
+    grouping = grouping or segment_grouping
+    text_segments = []
+    # Image blocks are left out: their pixel data is never needed here
+    text_blocks = page.get_text("dict", flags=fitz.TEXTFLAGS_DICT & ~fitz.TEXT_PRESERVE_IMAGES)["blocks"]
+    
+    for block in text_blocks:
+        if "lines" not in block:
+            continue
+        previous_group = None  # Segment of the previous line in this block, if that line was one style
+        for line in block["lines"]:
+            line_groups = []
+            for span in line["spans"]:
+                if not span["text"].strip():
+                    # Whitespace-only spans just keep the words of a group apart
+                    if line_groups and grouping != "span":
+                        line_groups[-1]['text'] += span["text"]
+                    continue
+                style = _span_style(span)
+                if grouping != "span" and line_groups and line_groups[-1]['style'] == style:
+                    group = line_groups[-1]
+                    group['text'] += span["text"]
+                    group['rect'] |= fitz.Rect(span["bbox"])
+                    group['redact_rects'][-1] |= _glyph_core(span, line)
+                    group['spans'] += 1
+                else:
+                    # Store all the span information we need
+                    line_groups.append({
+                        'text': span["text"],
+                        'rect': fitz.Rect(span["bbox"]),
+                        # One glyph core per line, see _glyph_core
+                        'redact_rects': [_glyph_core(span, line)],
+                        'is_bold': span['flags'] & 16,
+                        'color': span["color"],
+                        'size': span["size"],
+                        'style': style,
+                        'spans': 1,
+                    })
+            if not line_groups:
+                continue
+            
+            # Continue the previous line's segment if both lines are entirely in the same style
+            if (grouping == "block" and previous_group is not None and len(line_groups) == 1
+                    and previous_group['style'] == line_groups[0]['style']):
+                first = line_groups.pop(0)
+                head = previous_group['text'].rstrip()
+                tail = first['text'].lstrip()
+                # A word hyphenated across the line break is rejoined without a space
+                previous_group['text'] = head + tail if head.endswith("-") else head + " " + tail
+                previous_group['rect'] |= first['rect']
+                previous_group['redact_rects'] += first['redact_rects']
+                previous_group['spans'] += first['spans']
+                continue
+            text_segments.extend(line_groups)
+            previous_group = line_groups[0] if len(line_groups) == 1 else None
+    
+    # Drop fragments too short to be worth translating
+    segments = []
+    for segment in text_segments:
+        segment['text'] = segment['text'].strip()
+        # Plain tuples, so segments can be sent to the render worker processes as they are
+        segment['redact_rects'] = [tuple(rect) for rect in segment['redact_rects']]
+        del segment['style']
+        if len(segment['text']) >= 2:
+            segments.append(segment)
+    return segments
+
+def passthrough_reason(text_segments):
+    """
+    Why a page can be copied from the source unchanged, or None if it needs translating.
+    """
+    if not text_segments:
+        return "no text" if passthrough_text_free_pages else None
+    if passthrough_translated_pages:
+        page_text = "".join(segment['text'] for segment in text_segments)
+        if han_share(page_text) >= translated_page_han_share:
+            return "already translated"
+    return None
+
+def page_object_name(output_dir, page_num):
+    """
+    Object name of one translated page in "pages" mode, e.g. "0723/page_001.pdf".
+    """
+    return f"{output_dir}/page_{page_num + 1:03d}.pdf"
+
+def translate_pdf_with_bolding(input_path, output_path, regular_font, bold_font, mode=None,
+                               storage_client=None, scheduler=None, render_pool=None, export_prometheus=True):
     """
     Translates PDF text, preserving color and bolding.
+
+    Several documents can run at once on separate threads when they share one scheduler
+    and one render pool, which then enforce the concurrency limits across all of them.
+
+    Args:
+        mode (str): "single", "pages" or "both"; defaults to the output_mode setting.
+        storage_client: Storage backend to read from and write to; defaults to the storage_backend setting.
+        scheduler (TranslationScheduler): Shared scheduler; by default one is created for this document.
+        render_pool: Shared pool from page_renderer.create_render_pool; by default this document
+            renders with its own render_workers processes.
+        export_prometheus (bool): Write prometheus_textfile for this run. A batch turns it off
+            and writes one file for all of its documents instead.
+
+    Returns:
+        dict: The run's metrics report (stage timings, segment, retry, byte and token counters).
+        Its "status" is "done", "skipped" when a previous run already finished everything, or
+        "failed" when the input or fonts could not be read or some output was not saved.
     """
-    # Initialize Object Storage client
-    storage_client = Client()
-
-    # Check if PDF exists in Object Storage or local filesystem
-    pdf_data = None
-    if os.path.exists(input_path):
-        # Read from local file
-        with open(input_path, 'rb') as f:
-            pdf_data = f.read()
-    else:
-        try:
-            # Try to download from Object Storage
-            print(f"📥 Downloading '{input_path}' from Object Storage...")
-            pdf_data = storage_client.download_as_bytes(input_path)
-        except Exception as e:
-            print(f"❌ Error: The file '{input_path}' was not found in local storage or Object Storage. Error: {e}")
-            return
+    mode = mode or output_mode
+    metrics = RunMetrics("translate", document=input_path)
+    # Initialize the storage backend (Replit Object Storage unless configured otherwise)
+    storage_client = storage_client or get_storage(storage_backend)
+
     if not os.path.exists(regular_font):
-        print(f"❌ Error: Regular font '{regular_font}' not found.")
-        return
+        logger.error(f"❌ Error: Regular font '{regular_font}' not found.")
+        metrics.status = "failed"
+        return metrics.report()
     if not os.path.exists(bold_font):
-        print(f"❌ Error: Bold font '{bold_font}' not found. Bold text will use the regular font.")
+        logger.warning(f"❌ Error: Bold font '{bold_font}' not found. Bold text will use the regular font.")
         # Degrade gracefully by using regular font as a fallback
         bold_font = regular_font
 
-    print(f"📖 Opening '{input_path}'...")
-    original_doc = fitz.open(stream=pdf_data, filetype="pdf")
+    # The source is always opened by path: a local file directly, an Object Storage file after
+    # streaming it to a temporary file, so the PDF's bytes are never held in memory as a whole
+    source_path = input_path
+    temp_source_path = None
+    if not os.path.exists(input_path):
+        with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as temp_file:
+            temp_source_path = temp_file.name
+        try:
+            # Try to download from Object Storage
+            logger.info(f"📥 Downloading '{input_path}' from Object Storage...")
+            with metrics.stage('download'):
+                storage_client.download_to_filename(input_path, temp_source_path)
+        except Exception as e:
+            os.remove(temp_source_path)
+            logger.error(f"❌ Error: The file '{input_path}' was not found in local storage or Object Storage. Error: {e}")
+            metrics.status = "failed"
+            return metrics.report()
+        source_path = temp_source_path
+    metrics.count('source_bytes', os.path.getsize(source_path))
+
+    source = None
+    try:
+        logger.info(f"📖 Opening '{input_path}'...")
+        with mupdf_lock:
+            source = SourceDocument(source_path, source_recycle_interval)
+        return _translate_source(source, input_path, output_path, regular_font, bold_font, mode,
+                                 storage_client, scheduler, render_pool, metrics, export_prometheus)
+    finally:
+        # Also reached when a phase raises, so the downloaded copy is never left behind
+        if source is not None:
+            with mupdf_lock:
+                source.close()
+        if temp_source_path:
+            os.remove(temp_source_path)
+
+def _translate_source(source, input_path, output_path, regular_font, bold_font, mode, storage_client,
+                      scheduler, render_pool, metrics, export_prometheus):
+    """
+    Runs the extract, translate and render phases on an opened SourceDocument;
+    see translate_pdf_with_bolding.
+    """
+    write_single = mode in ("single", "both")
+    write_pages = mode in ("pages", "both")
+    page_count = source.page_count
 
     # Create output directory name based on input filename
     base_name = os.path.splitext(input_path)[0]  # Remove extension
     output_dir = base_name
     
-    print("🚀 Starting translation process with bold detection...")
-    print(f"📄 Each page will be saved as a separate PDF in Object Storage under '{output_dir}/' folder")
+    logger.info("🚀 Starting translation process with bold detection...")
+    if write_single:
+        logger.info(f"📄 Translated pages will be written into one document: '{output_path}'")
+    if write_pages:
+        logger.info(f"📄 Each page will be saved as a separate PDF in Object Storage under '{output_dir}/' folder")
+
+    # Phase 1: Extract every page's spans into one document-level segment table,
+    # deduplicating repeated strings (headers, footers, bylines) by normalized text
+    extract_start = time.perf_counter()
+    segment_table = SegmentTable()
+    page_hashes = []
+    passthrough_pages = {}  # page_num -> reason the page is copied unchanged
+    for page_num in range(page_count):
+        with mupdf_lock:
+            original_doc = source.for_page()
+            page = original_doc[page_num]
+            if passthrough_text_free_pages and not page.get_fonts():
+                # A page without fonts cannot hold text, so skip the text extraction entirely
+                text_segments = []
+            else:
+                text_segments = extract_text_segments(page)
+            page_hashes.append(page_content_hash(original_doc, page_num))
+        reason = passthrough_reason(text_segments)
+        if reason:
+            passthrough_pages[page_num] = reason
+            text_segments = []  # Nothing on these pages is sent for translation
+        segment_table.add_page(text_segments)
+    metrics.add_time('extract', time.perf_counter() - extract_start)
+    if passthrough_pages:
+        already_translated = sum(1 for reason in passthrough_pages.values() if reason == "already translated")
+        logger.info(f"⏭️ Copying {len(passthrough_pages)} pages unchanged "
+                    f"({len(passthrough_pages) - already_translated} without text, "
+                    f"{already_translated} already in {target_language})")
+    span_count = sum(segment['spans'] for text_segments in segment_table.pages for segment in text_segments)
+    logger.info(f"🔎 Grouped {span_count} spans into {segment_table.total_segments} segments ({segment_grouping} level), "
+                f"{len(segment_table.texts)} unique "
+                f"({segment_table.dedupe_ratio:.0%} of translation work avoided by deduplication)")
+
+    # Resume: find pages a previous run already finished from identical source content
+    manifest = JobManifest.load(storage_client, f"{output_dir}/manifest.json", input_path)
+    completed_pages = set()
+    if resume_jobs:
+        # Only a page's own page_NNN.pdf counts as finished; the single document is checked on its own
+        if write_pages:
+            completed_pages = {
+                page_num for page_num in range(page_count)
+                if manifest.is_complete(page_num, page_hashes[page_num], page_object_name(output_dir, page_num))
+            }
+        single_done = (not write_single or (manifest.is_document_complete(output_path, page_hashes)
+                                            and storage_client.exists(output_path)))
+        if single_done and (not write_pages or len(completed_pages) == page_count):
+            logger.info(f"✅ All {page_count} pages are already translated and uploaded - nothing to do")
+            metrics.status = "skipped"
+            return metrics.report()
+        if completed_pages:
+            logger.info(f"⏩ Resuming: {len(completed_pages)} of {page_count} pages already done, skipping them")
+    pages_to_render = [page_num for page_num in range(page_count) if page_num not in completed_pages]
+
+    # Phase 2: Translate only the unique strings, packed into token-budgeted requests
+    translation_start = time.perf_counter()
+    unique_segments = segment_table.unique_segments(pages_to_render)
+    resolved = {}
+    cache = get_translation_cache()
+    if cache is not None:
+        # Look the whole document up once here rather than in every request, which the scheduler
+        # may send again (429 back-off, re-requests, splits) and would count the hits again
+        hits = cache.get_many([segment['text'] for _, segment in unique_segments])
+        resolved = {text_id: hits[segment['text']] for text_id, segment in unique_segments if segment['text'] in hits}
+        unique_segments = [(text_id, segment) for text_id, segment in unique_segments if text_id not in resolved]
+        metrics.count('cache_hits', len(resolved))
+    packed_batches = pack_segments(
+        unique_segments,
+        input_token_budget=batch_input_token_budget,
+        output_token_budget=batch_output_token_budget,
+        max_segments=max_segments_per_batch,
+    )
+    logger.info(f"🌐 Translating {len(unique_segments)} unique segments in {len(packed_batches)} "
+                f"token-budgeted requests ({translation_concurrency} in flight, {len(resolved)} served from the cache)")
+    translate_fn = functools.partial(translate_batch_with_openai, metrics=metrics, cache_lookup=False)
+    translation_stats = TranslationScheduler.new_stats()
+    own_scheduler = scheduler is None
+    if own_scheduler:
+        scheduler = TranslationScheduler(
+            translate_fn,
+            max_in_flight=translation_concurrency,
+            requests_per_minute=requests_per_minute,
+            tokens_per_minute=tokens_per_minute,
+            token_estimator=estimate_batch_tokens,
+            max_partial_retries=max_partial_retries,
+        )
+    try:
+        batch_results = scheduler.translate_all(
+            [[segment for _, segment in packed] for packed in packed_batches],
+            translate_fn=translate_fn,
+            stats=translation_stats,
+        )
+    finally:
+        if own_scheduler:
+            scheduler.shutdown()
+
+    # Resolve batch-local ids back to text ids
+    cached_count = len(resolved)
+    for packed, batch_translations in zip(packed_batches, batch_results):
+        for batch_id, (text_id, _) in enumerate(packed):
+            value = batch_translations.get(str(batch_id))
+            if value:
+                resolved[text_id] = value
+    translation_elapsed = time.perf_counter() - translation_start
+    metrics.add_time('translate', translation_elapsed)
+    for name in ('requests', 'rate_limited', 'retried_segments', 'splits', 'failed_batches'):
+        metrics.count(name, translation_stats[name])
+    logger.info(f"📊 Translated {len(resolved) - cached_count}/{len(unique_segments)} unique segments in "
+                f"{translation_stats['requests']} requests ({translation_stats['rate_limited']} rate-limit retries, "
+                f"{translation_stats['retried_segments']} segments re-requested, {translation_stats['splits']} splits, "
+                f"{translation_stats['failed_batches']} failed) in {translation_elapsed:.1f}s")
+    if cache is not None:
+        cache_stats = cache.stats()
+        logger.info(f"💾 Translation cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses "
+                    f"({cache_stats['hit_rate']:.0%} hit rate), {cache_stats['evictions']} evicted")
+
+    # Extraction is done; the renderers open their own copies of the source,
+    # and this one is only kept for copying passthrough pages
+    passthrough_source = source if any(page_num in passthrough_pages for page_num in pages_to_render) else None
+    if passthrough_source is None:
+        with mupdf_lock:
+            source.close()
+
+    # Phase 3: Render every remaining page from the resolved table, in parallel across processes
+    render_jobs = []
+    untranslated_counts = {}
+    for page_num in pages_to_render:
+        if page_num in passthrough_pages:
+            untranslated_counts[page_num] = 0
+            if write_pages:
+                manifest.mark(page_num, "translated", page_hashes[page_num], untranslated=0,
+                              passthrough=passthrough_pages[page_num])
+            continue
+        text_segments = segment_table.pages[page_num]
+        translations = segment_table.page_translations(page_num, resolved)
+        untranslated_counts[page_num] = len(text_segments) - len(translations)
+        if write_pages:
+            manifest.mark(page_num, "partial" if untranslated_counts[page_num] else "translated",
+                          page_hashes[page_num], untranslated=untranslated_counts[page_num])
+        render_jobs.append((page_num, text_segments, translations))
+    manifest.save()
+    render_start = time.perf_counter()
+    with mupdf_lock:
+        output_doc = AssembledDocument(single_compact_interval) if write_single else None
+    page_bytes_total = 0
+    passthrough_bytes = 0
+    bytes_uploaded = 0
+    single_size = 0
+    single_saved = False
+    missing_pages = 0
+    upload_queue = UploadQueue(storage_client, max_pending=upload_queue_depth, workers=upload_workers,
+                               max_retries=upload_retries)
+
+    def page_failed(page_num, error):
+        logger.error(f"      ❌ Error saving page {page_num + 1}: {error}")
+        if write_pages:
+            manifest.mark(page_num, "failed", page_hashes[page_num], error=str(error))
+
+    def page_uploaded(page_num, storage_page_path, error):
+        # Runs on an upload thread once the page is stored or has finally failed
+        if error is None:
+            manifest.mark(page_num, "uploaded", page_hashes[page_num], object=storage_page_path,
+                          untranslated=untranslated_counts[page_num])
+            logger.debug(f"      ✅ Saved to Object Storage: {storage_page_path}")
+        else:
+            page_failed(page_num, error)
+
+    render_workers_label = "the shared render pool" if render_pool else f"{render_workers} worker process(es)"
+    logger.info(f"🎨 Rendering {len(render_jobs)} pages with {render_workers_label}, text removal: {text_removal}...")
+    rendered_pages = render_pages(source.path, render_jobs, regular_font, bold_font, workers=render_workers,
+                                  text_removal=text_removal, recycle_interval=source_recycle_interval,
+                                  pool=render_pool)
+    try:
+        for page_num in range(page_count):
+            if page_num in completed_pages:
+                # Finished by a previous run: reuse its uploaded page for the single document
+                if output_doc is None:
+                    continue
+                try:
+                    page_pdf = storage_client.download_as_bytes(manifest.page(page_num)["object"])
+                    with metrics.stage('insert'), mupdf_lock, fitz.open(stream=page_pdf, filetype="pdf") as page_doc:
+                        output_doc.insert_pdf(page_doc)
+                    logger.debug(f"    -> Reused page {page_num + 1}/{page_count} from the previous run")
+                except Exception as e:
+                    logger.error(f"      ❌ Error reusing page {page_num + 1}: {e}")
+                    manifest.mark(page_num, "failed", page_hashes[page_num], error=str(e))
+                    missing_pages += 1
+                continue
 
-    for page_num, page in enumerate(original_doc):
-        print(f"    -> Processing page {page_num + 1}/{len(original_doc)}...")
-        
-        # Create a new document for this single page
-        single_page_doc = fitz.open()
-        new_page = single_page_doc.new_page(width=page.rect.width, height=page.rect.height)
-        new_page.show_pdf_page(new_page.rect, original_doc, page_num)
-
-        # Step 1: Collect all text segments from the page
-        text_segments = []
-        text_blocks = page.get_text("dict")["blocks"]
-        
-        for block in text_blocks:
-            if "lines" in block:
-                for line in block["lines"]:
-                    for span in line["spans"]:
-                        original_text = span["text"].strip()
-                        if original_text and len(original_text.strip()) >= 2:
-                            # Store all the span information we need
-                            text_segments.append({
-                                'text': original_text,
-                                'rect': fitz.Rect(span["bbox"]),
-                                'is_bold': span['flags'] & 16,
-                                'color': span["color"],
-                                'size': span["size"]
-                            })
-        
-        print(f"      - Total text segments found: {len(text_segments)}")
-        
-        if not text_segments:
-            print(f"      - No text segments found on this page, creating empty translated page...")
-            # Still need to save the page even if it has no text to translate
             try:
-                page_filename = f"page_{page_num + 1:03d}.pdf"
-                storage_page_path = f"{output_dir}/{page_filename}"
-                
-                # Save to a temporary bytes buffer instead of local file
-                import io
-                pdf_bytes = io.BytesIO()
-                single_page_doc.save(pdf_bytes, garbage=4, deflate=True, clean=True)
-                pdf_bytes.seek(0)
-                
-                # Upload directly to Object Storage
-                storage_client.upload_from_bytes(storage_page_path, pdf_bytes.getvalue())
-                print(f"      ✅ Saved to Object Storage: {storage_page_path}")
+                if page_num in passthrough_pages:
+                    # Copied straight from the source: no rendering and no translation request
+                    logger.debug(f"    -> Copying page {page_num + 1}/{page_count} unchanged ({passthrough_pages[page_num]})")
+                    with metrics.stage('passthrough'), mupdf_lock:
+                        passthrough_doc = passthrough_source.for_page()
+                        if output_doc is not None:
+                            output_doc.insert_pdf(passthrough_doc, from_page=page_num, to_page=page_num)
+                        page_pdf = copy_page(passthrough_doc, page_num) if write_pages else b""
+                    passthrough_bytes += len(page_pdf)
+                else:
+                    _, page_pdf, page_stats = next(rendered_pages)
+                    logger.debug(f"    -> Processing page {page_num + 1}/{page_count}...")
+                    if page_pdf is None:
+                        raise RuntimeError(page_stats['error'])
+                    page_bytes_total += len(page_pdf)
+                    # Fitting and saving happen in the render processes; they report their own timings
+                    metrics.add_time('fit_render', page_stats['render_seconds'])
+                    metrics.add_time('page_save', page_stats['save_seconds'])
                     
+                    # Append the page straight into the single output document
+                    if output_doc is not None:
+                        with metrics.stage('insert'), mupdf_lock, fitz.open(stream=page_pdf, filetype="pdf") as page_doc:
+                            output_doc.insert_pdf(page_doc)
             except Exception as e:
-                print(f"      ❌ Error saving empty page {page_num + 1}: {e}")
-            finally:
-                single_page_doc.close()
-            continue
+                # One bad page must not cost the rest of the document
+                page_failed(page_num, e)
+                missing_pages += 1
+                continue
             
-        print(f"      - Found {len(text_segments)} text segments, translating in batch...")
-        
-        # Step 2: Translate text segments in batches (limit batch size to prevent token overflow)
-        batch_size = 50  # Limit batch size to prevent token issues
-        all_translations = {}
-        
-        for i in range(0, len(text_segments), batch_size):
-            batch = text_segments[i:i+batch_size]
-            print(f"      - Translating batch {i//batch_size + 1} ({len(batch)} segments)...")
-            batch_translations = translate_batch_with_openai(batch)
+            if not write_pages:
+                continue
             
-            # Adjust indices for the overall segment list
-            for key, value in batch_translations.items():
-                all_translations[str(int(key) + i)] = value
-        
-        translations = all_translations
-        
-        # Step 3: Apply translations to the page
-        for i, segment in enumerate(text_segments):
+            # Queue this single page as its own PDF; it uploads while the next page renders
+            storage_page_path = page_object_name(output_dir, page_num)
+            upload_queue.submit(storage_page_path, page_pdf,
+                                callback=functools.partial(page_uploaded, page_num, storage_page_path))
+            if (page_num + 1) % manifest_save_interval == 0:
+                manifest.save()
+        if passthrough_source is not None:
+            with mupdf_lock:
+                passthrough_source.close()
+        render_elapsed = time.perf_counter() - render_start
+        metrics.add_time('render', render_elapsed)
+        logger.info(f"📊 Rendered {len(render_jobs)} pages in {render_elapsed:.1f}s")
+        if render_jobs and page_bytes_total:
+            logger.info(f"📊 Per page: {page_bytes_total / len(render_jobs) / 1024:.1f} KB, "
+                        f"{metrics.stage_seconds()['page_save'] / len(render_jobs) * 1000:.1f} ms to save ({text_removal} mode)")
+
+        if output_doc is not None and missing_pages:
+            logger.error(f"❌ Not saving '{output_path}': {missing_pages} page(s) could not be rendered or reused, "
+                         f"rerun to redo them")
+            manifest.mark_document(output_path, "failed", page_hashes, error=f"{missing_pages} page(s) missing")
+        elif output_doc is not None:
+            # Save once with the fonts embedded and subset a single time, then upload that one file
             try:
-                # Get the translation for this segment
-                translated_text = translations.get(str(i))
-                if not translated_text:
-                    print(f"      - No translation found for segment {i}: '{segment['text'][:30]}...'")
-                    continue
-                
-                # Choose the font based on boldness
-                if segment['is_bold']:
-                    font_file_to_use = bold_font
-                    font_name_for_pdf = "china-font-bold"
-                else:
-                    font_file_to_use = regular_font
-                    font_name_for_pdf = "china-font-regular"
-                
-                # Step 1: Draw a white/light background rectangle to cover the original text
-                # Expand the rectangle slightly to ensure full coverage
-                cover_rect = fitz.Rect(
-                    segment['rect'].x0 - 1,  # Slightly expand left
-                    segment['rect'].y0 - 1,  # Slightly expand top
-                    segment['rect'].x1 + 1,  # Slightly expand right
-                    segment['rect'].y1 + 1   # Slightly expand bottom
-                )
-                
-                # Draw white rectangle to cover original text
-                new_page.draw_rect(cover_rect, color=None, fill=(1, 1, 1))  # White fill
-                
-                # Step 2: Normalize color values to 0-1 range and ensure visible color
-                original_color = segment['color']
-                if isinstance(original_color, int):
-                    # Convert integer color to RGB tuple (0-1 range)
-                    r = ((original_color >> 16) & 255) / 255.0
-                    g = ((original_color >> 8) & 255) / 255.0
-                    b = (original_color & 255) / 255.0
-                    normalized_color = (r, g, b)
-                elif isinstance(original_color, (list, tuple)):
-                    # Ensure color components are in 0-1 range
-                    if len(original_color) >= 3:
-                        # Check if values are in 0-255 range and normalize
-                        if any(c > 1.0 for c in original_color[:3]):
-                            normalized_color = tuple(c / 255.0 for c in original_color[:3])
-                        else:
-                            normalized_color = tuple(original_color[:3])
-                    else:
-                        normalized_color = (0, 0, 0)  # Default to black
-                else:
-                    normalized_color = (0, 0, 0)  # Default to black
-                
-                # Ensure the color is not white or too light (which would be invisible on white background)
-                if sum(normalized_color) > 2.7:  # If color is very light/white
-                    normalized_color = (0, 0, 0)  # Use black instead
-                    print(f"      - Changed white/light text to black for visibility")
-                
-                # Step 3: Insert the translated text with better font sizing
-                text_inserted = False
-                original_font_size = segment['size']
-                
-                # Start with larger font sizes and work down - be less aggressive with shrinking
-                for font_scale in [1.2, 1.0, 0.9, 0.8, 0.7, 0.6]:
-                    try:
-                        scaled_font_size = original_font_size * font_scale
-                        
-                        result = new_page.insert_textbox(
-                            segment['rect'],
-                            translated_text,
-                            fontname=font_name_for_pdf,
-                            fontfile=font_file_to_use,
-                            fontsize=scaled_font_size,
-                            color=normalized_color,
-                            align=fitz.TEXT_ALIGN_LEFT
-                        )
-                        
-                        if result > 0:  # Successful insertion
-                            if font_scale != 1.0:
-                                print(f"      - Text inserted with {int(font_scale*100)}% font size for segment {i}")
-                            text_inserted = True
-                            break
-                        elif result == 0:  # Text fits exactly
-                            text_inserted = True
-                            break
-                            
-                    except Exception as text_error:
-                        continue  # Try next font scale
-                
-                # If textbox insertion failed, try simple text insertion with better sizing
-                if not text_inserted:
-                    try:
-                        # Calculate position for simple text insertion
-                        text_x = segment['rect'].x0
-                        text_y = segment['rect'].y0 + (segment['rect'].height * 0.8)  # Position text better within rect
-                        
-                        new_page.insert_text(
-                            (text_x, text_y),
-                            translated_text,
-                            fontname=font_name_for_pdf,
-                            fontfile=font_file_to_use,
-                            fontsize=original_font_size * 0.8,  # Less aggressive shrinking for fallback
-                            color=normalized_color
-                        )
-                        print(f"      - Used fallback text insertion for segment {i}")
-                        text_inserted = True
-                    except Exception as fallback_error:
-                        print(f"      - All text insertion methods failed for segment {i}: {fallback_error}")
-                        print(f"        Original: '{segment['text'][:30]}...'")
-                        print(f"        Translation: '{translated_text[:30]}...'")
-                
-                if text_inserted:
-                    if segment['is_bold']:
-                        print(f"      - Successfully inserted BOLD text for segment {i}")
-                    else:
-                        print(f"      - Successfully inserted text for segment {i}")
-                else:
-                    print(f"      - Failed to insert text for segment {i} - skipping")
+                with tempfile.TemporaryDirectory() as temp_dir:
+                    local_output_path = os.path.join(temp_dir, os.path.basename(output_path))
+                    with metrics.stage('save'), mupdf_lock:
+                        single_size = output_doc.save(local_output_path)
+                    with metrics.stage('upload'):
+                        storage_client.upload_from_filename(output_path, local_output_path)
+                bytes_uploaded += single_size
+                single_saved = True
+                manifest.mark_document(output_path, "uploaded", page_hashes,
+                                       untranslated=sum(untranslated_counts.values()))
+                logger.info(f"✅ Saved translated document to Object Storage: {output_path} ({single_size / 1e6:.1f} MB)")
             except Exception as e:
-                print(f"      - Could not process segment {i}: '{segment['text'][:30]}...'. Error: {e}")
-        
-        # Save this single page as its own PDF directly to Object Storage
-        try:
-            page_filename = f"page_{page_num + 1:03d}.pdf"
-            storage_page_path = f"{output_dir}/{page_filename}"
-            
-            # Save to a temporary bytes buffer instead of local file
-            import io
-            pdf_bytes = io.BytesIO()
-            single_page_doc.save(pdf_bytes, garbage=4, deflate=True, clean=True)
-            pdf_bytes.seek(0)
-            
-            # Upload directly to Object Storage
-            storage_client.upload_from_bytes(storage_page_path, pdf_bytes.getvalue())
-            print(f"      ✅ Saved to Object Storage: {storage_page_path}")
-                
-        except Exception as e:
-            print(f"      ❌ Error saving page {page_num + 1}: {e}")
-        finally:
-            single_page_doc.close()
-    print(f"✅ Translation complete! All pages saved individually in Object Storage under '{output_dir}/' folder")
-    print(f"📁 Check Object Storage to see pages 1-{len(original_doc)} in the '{output_dir}' folder")
-    original_doc.close()
+                logger.error(f"❌ Error saving translated document '{output_path}': {e}")
+                manifest.mark_document(output_path, "failed", page_hashes, error=str(e))
+    finally:
+        # Stops this document's own render processes if the loop ended early
+        rendered_pages.close()
+        if output_doc is not None:
+            with mupdf_lock:
+                output_doc.close()
+        # Wait for the background page uploads before recording the final state
+        with metrics.stage('upload_wait'):
+            upload_queue.close()
+        manifest.save()
+    if upload_queue.uploaded:
+        metrics.add_time('page_upload', upload_queue.upload_seconds, count=upload_queue.uploaded)
+    bytes_uploaded += upload_queue.bytes_uploaded
+    if upload_queue.retries or upload_queue.failures:
+        logger.warning(f"📤 Page uploads: {upload_queue.retries} retries, {len(upload_queue.failures)} failed")
+    logger.info(f"🗂️ Job manifest: {manifest.counts()}")
+    if write_pages and upload_queue.uploaded:
+        # Keep the folder index current so merge_pdfs.py can list folders without scanning the bucket
+        FolderIndex(storage_client).record(output_dir)
+
+    # The two-script flow uploads every page, downloads them all again to merge, then uploads the merge
+    elapsed = metrics.elapsed
+    all_page_bytes = page_bytes_total + passthrough_bytes
+    two_script_transfer = 2 * all_page_bytes + (single_size or all_page_bytes)
+    logger.info(f"📊 Uploaded {bytes_uploaded / 1e6:.1f} MB in {elapsed:.1f}s end to end "
+                f"(pages + merge_pdfs.py would transfer ~{two_script_transfer / 1e6:.1f} MB)")
+    unsaved_pages = []
+    if write_pages:
+        unsaved_pages = [page_num + 1 for page_num in range(page_count)
+                         if manifest.page(page_num).get("state") != "uploaded"]
+        if unsaved_pages:
+            logger.error(f"❌ Translation incomplete: {len(unsaved_pages)} of {page_count} pages were not saved under "
+                         f"'{output_dir}/' (pages {unsaved_pages}), rerun to redo them")
+        else:
+            logger.info(f"✅ Translation complete! All pages saved individually in Object Storage under '{output_dir}/' folder")
+            logger.info(f"📁 Check Object Storage to see pages 1-{page_count} in the '{output_dir}' folder")
+    if write_single:
+        if single_saved:
+            logger.info(f"✅ Translation complete! Translated document saved as '{output_path}'")
+        else:
+            logger.error(f"❌ Translation incomplete: '{output_path}' was not saved, rerun to redo it")
+    metrics.status = "failed" if unsaved_pages or (write_single and not single_saved) else "done"
+    metrics.count('pages', page_count)
+    metrics.count('rendered_pages', len(render_jobs))
+    metrics.count('passthrough_pages', sum(1 for page_num in pages_to_render if page_num in passthrough_pages))
+    metrics.count('segments', segment_table.total_segments)
+    metrics.count('unique_segments', len(segment_table.texts))
+    metrics.count('translated_segments', len(resolved))
+    metrics.count('untranslated_segments', sum(untranslated_counts.values()))
+    metrics.count('page_bytes', page_bytes_total)
+    metrics.count('bytes_uploaded', bytes_uploaded)
+    metrics.count('upload_retries', upload_queue.retries)
+    metrics.count('upload_failures', len(upload_queue.failures))
+    metrics.export(metrics_report_dir, prometheus_textfile if export_prometheus else None)
+    return metrics.report()
 
 # --- Run the script ---
 if __name__ == "__main__":
-    translate_pdf_with_bolding(input_pdf, output_pdf, font_path_regular, font_path_bold)
\ No newline at end of file
+    configure_logging(log_level)
+    run_report = translate_pdf_with_bolding(input_pdf, output_pdf, font_path_regular, font_path_bold)
+    if run_report["status"] == "failed":
+        raise SystemExit(1)
\ No newline at end of file
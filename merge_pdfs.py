@@ -1,143 +1,231 @@
-
 import fitz  # PyMuPDF
+import io
+import logging
 import os
-from replit.object_storage import Client
+import resource
+import sys
+import tempfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from metrics import RunMetrics, configure_logging
+from storage import FolderIndex, get_storage, list_page_objects, merged_object_name
+
+logger = logging.getLogger(__name__)
 
-def merge_pdfs_from_folder(folder_path):
+def _download_page(storage_client, object_name, metrics=None):
+    """
+    Downloads one page object; runs on the prefetch thread pool.
+    """
+    if metrics is None:
+        return storage_client.download_as_bytes(object_name)
+    with metrics.stage('download'):
+        return storage_client.download_as_bytes(object_name)
+
+def _peak_rss_mb(who=resource.RUSAGE_SELF):
+    """
+    Peak resident memory of this process (or, with RUSAGE_CHILDREN, of its largest finished
+    child) in MB (ru_maxrss is KB on Linux, bytes on macOS).
+    """
+    peak = resource.getrusage(who).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+def merge_pdfs_from_folder(folder_path, prefetch_window=None, spill_to_disk=None, storage_client=None):
     """
     Merges all PDF files from a specified folder in Object Storage into a single PDF.
     
+    Page objects are downloaded concurrently, at most `prefetch_window` ahead of the
+    page being merged, so the merge is limited by bandwidth rather than round trips.
+    
     Args:
         folder_path (str): The folder path in Object Storage (e.g., "0723.pdf")
+        prefetch_window (int): Maximum downloads in flight; defaults to the download_concurrency setting
+        spill_to_disk (bool): Save the merged PDF to a temporary file instead of memory before uploading
+        storage_client: Storage backend; defaults to the STORAGE_BACKEND environment variable
+
+    Returns:
+        dict: The run's metrics report (download/wait/insert/save/upload timings, file, page
+        and byte counters), or None if nothing was merged.
     """
-    # Initialize Object Storage client
-    storage_client = Client()
+    if prefetch_window is None:
+        prefetch_window = download_concurrency
+    if spill_to_disk is None:
+        spill_to_disk = spill_merged_to_disk
     
-    print(f"🔍 Looking for PDF files in Object Storage folder: '{folder_path}'")
+    # Initialize the storage backend (Replit Object Storage unless configured otherwise)
+    storage_client = storage_client or get_storage()
+    metrics = RunMetrics("merge", folder=folder_path)
+    
+    logger.info(f"🔍 Looking for PDF files in Object Storage folder: '{folder_path}'")
     
     try:
-        # List all objects in the bucket
-        all_objects = storage_client.list()
-        
-        # Filter objects that are in our target folder and are PDF files
-        pdf_objects = []
-        for obj in all_objects:
-            if obj.name.startswith(f"{folder_path}/") and obj.name.endswith(".pdf"):
-                pdf_objects.append(obj)
+        # List only the target folder's PDF files, sorted by name so pages stay in order
+        # (page_001.pdf, page_002.pdf, etc.), skipping the output of a previous merge
+        storage_path = merged_object_name(folder_path)
+        merged_filename = storage_path.rsplit("/", 1)[1]
+        with metrics.stage('list'):
+            pdf_objects = list_page_objects(storage_client, folder_path)
         
         if not pdf_objects:
-            print(f"❌ No PDF files found in folder '{folder_path}'")
+            logger.error(f"❌ No PDF files found in folder '{folder_path}'")
             return
         
-        # Sort the PDF objects by name to ensure correct order (page_001.pdf, page_002.pdf, etc.)
-        pdf_objects.sort(key=lambda x: x.name)
-        
-        print(f"📄 Found {len(pdf_objects)} PDF files to merge:")
+        logger.info(f"📄 Found {len(pdf_objects)} PDF files to merge:")
         for obj in pdf_objects:
-            print(f"   - {obj.name}")
+            logger.debug(f"   - {obj.name}")
         
         # Create a new PDF document for the merged result
         merged_doc = fitz.open()
-        
-        print("🔄 Starting merge process...")
-        
-        # Process each PDF file
-        for i, pdf_obj in enumerate(pdf_objects):
-            try:
-                print(f"   -> Processing {pdf_obj.name} ({i+1}/{len(pdf_objects)})")
-                
-                # Download the PDF from Object Storage
-                pdf_data = storage_client.download_as_bytes(pdf_obj.name)
-                
-                # Open the PDF
-                current_doc = fitz.open(stream=pdf_data, filetype="pdf")
-                
-                # Add all pages from this PDF to the merged document
-                for page_num in range(len(current_doc)):
-                    merged_doc.insert_pdf(current_doc, from_page=page_num, to_page=page_num)
-                
-                current_doc.close()
-                print(f"      ✅ Added {len(current_doc)} page(s) from {pdf_obj.name}")
-                
-            except Exception as e:
-                print(f"      ❌ Error processing {pdf_obj.name}: {e}")
-                continue
+        merged_files = 0
+        bytes_downloaded = 0
+        
+        logger.info(f"🔄 Starting merge process ({prefetch_window} downloads in flight)...")
+        
+        with ThreadPoolExecutor(max_workers=max(1, prefetch_window)) as executor:
+            # Keep a bounded window of downloads running ahead of the merge
+            pending = deque()
+            next_index = 0
+            while next_index < len(pdf_objects) and len(pending) < prefetch_window:
+                pending.append(executor.submit(_download_page, storage_client, pdf_objects[next_index].name, metrics))
+                next_index += 1
+            
+            # Process each PDF file in order as its download completes
+            for i, pdf_obj in enumerate(pdf_objects):
+                future = pending.popleft()
+                if next_index < len(pdf_objects):
+                    pending.append(executor.submit(_download_page, storage_client, pdf_objects[next_index].name, metrics))
+                    next_index += 1
+                try:
+                    logger.debug(f"   -> Processing {pdf_obj.name} ({i+1}/{len(pdf_objects)})")
+                    
+                    # Wait for the prefetched download
+                    with metrics.stage('download_wait'):
+                        pdf_data = future.result()
+                    bytes_downloaded += len(pdf_data)
+                    
+                    # Add all pages from this PDF to the merged document in one call
+                    with metrics.stage('insert'), fitz.open(stream=pdf_data, filetype="pdf") as current_doc:
+                        page_count = len(current_doc)
+                        merged_doc.insert_pdf(current_doc)
+                    del pdf_data
+                    merged_files += 1
+                    logger.debug(f"      ✅ Added {page_count} page(s) from {pdf_obj.name}")
+                    
+                except Exception as e:
+                    logger.error(f"      ❌ Error processing {pdf_obj.name}: {e}")
+                    metrics.count('failed_files')
+                    continue
         
         if len(merged_doc) == 0:
-            print("❌ No pages were successfully merged. Aborting.")
+            logger.error("❌ No pages were successfully merged. Aborting.")
             merged_doc.close()
             return
         
-        print(f"📋 Merged document contains {len(merged_doc)} total pages")
-        
-        # Save the merged PDF to a temporary bytes buffer
-        import io
-        merged_pdf_bytes = io.BytesIO()
-        merged_doc.save(merged_pdf_bytes, garbage=4, deflate=True, clean=True)
-        merged_pdf_bytes.seek(0)
+        total_pages = len(merged_doc)
+        logger.info(f"📋 Merged document contains {total_pages} total pages")
         
         # Upload the merged PDF back to Object Storage in the same folder
-        merged_filename = f"{folder_path}_merged.pdf"
-        storage_path = f"{folder_path}/{merged_filename}"
-        
-        storage_client.upload_from_bytes(storage_path, merged_pdf_bytes.getvalue())
-        
-        print(f"✅ Successfully merged {len(pdf_objects)} PDF files!")
-        print(f"📁 Merged PDF saved as: {storage_path}")
-        print(f"📊 Total pages in merged PDF: {len(merged_doc)}")
-        
-        merged_doc.close()
+        if spill_to_disk:
+            # Save to a temporary file so the merged output never has to fit in RAM twice
+            with tempfile.TemporaryDirectory() as temp_dir:
+                local_path = os.path.join(temp_dir, merged_filename)
+                with metrics.stage('save'):
+                    merged_doc.save(local_path, garbage=4, deflate=True, clean=True)
+                merged_doc.close()
+                merged_size = os.path.getsize(local_path)
+                with metrics.stage('upload'):
+                    storage_client.upload_from_filename(storage_path, local_path)
+        else:
+            # Save the merged PDF to a temporary bytes buffer
+            merged_pdf_bytes = io.BytesIO()
+            with metrics.stage('save'):
+                merged_doc.save(merged_pdf_bytes, garbage=4, deflate=True, clean=True)
+            merged_doc.close()
+            merged_size = merged_pdf_bytes.getbuffer().nbytes
+            with metrics.stage('upload'):
+                storage_client.upload_from_bytes(storage_path, merged_pdf_bytes.getvalue())
+        
+        elapsed = metrics.elapsed
+        logger.info(f"✅ Successfully merged {merged_files} PDF files!")
+        logger.info(f"📁 Merged PDF saved as: {storage_path}")
+        logger.info(f"📊 Total pages in merged PDF: {total_pages}")
+        logger.info(f"📊 Downloaded {bytes_downloaded / 1e6:.1f} MB, uploaded {merged_size / 1e6:.1f} MB in {elapsed:.1f}s "
+                    f"(peak memory {_peak_rss_mb():.0f} MB)")
+        metrics.count('files', merged_files)
+        metrics.count('pages', total_pages)
+        metrics.count('bytes_downloaded', bytes_downloaded)
+        metrics.count('merged_bytes', merged_size)
+        metrics.set('peak_rss_mb', round(_peak_rss_mb(), 1))
+        metrics.status = "done"
+        metrics.export(metrics_report_dir, prometheus_textfile)
+        return metrics.report()
         
     except Exception as e:
-        print(f"❌ Error during merge process: {e}")
+        logger.error(f"❌ Error during merge process: {e}")
 
-def list_available_folders():
+def list_available_folders(storage_client=None, refresh=None):
     """
     Lists available folders in Object Storage that contain PDF files.
+    
+    Reads the cached folder index that main.py keeps up to date, so this does not scan the
+    whole bucket; the index is rebuilt from a full listing if it is missing or `refresh` is set.
+    
+    Args:
+        storage_client: Storage backend; defaults to the STORAGE_BACKEND environment variable
+        refresh (bool): Rebuild the index first; defaults to the refresh_folder_index setting
     """
-    storage_client = Client()
+    storage_client = storage_client or get_storage()
+    if refresh is None:
+        refresh = refresh_folder_index
     
     try:
-        all_objects = storage_client.list()
-        folders = set()
-        
-        for obj in all_objects:
-            if "/" in obj.name and obj.name.endswith(".pdf"):
-                folder = obj.name.split("/")[0]
-                folders.add(folder)
+        folders = FolderIndex(storage_client).folders(refresh=refresh)
         
         if folders:
-            print("📂 Available folders with PDF files:")
+            logger.info("📂 Available folders with PDF files:")
             for folder in sorted(folders):
-                print(f"   - {folder}")
+                logger.info(f"   - {folder} ({folders[folder]['pages']} pages)")
             return sorted(folders)
         else:
-            print("❌ No folders with PDF files found in Object Storage")
+            logger.warning("❌ No folders with PDF files found in Object Storage")
             return []
             
     except Exception as e:
-        print(f"❌ Error listing folders: {e}")
+        logger.error(f"❌ Error listing folders: {e}")
         return []
 
 # --- Configuration ---
 # Set the folder path you want to merge PDFs from
 # Example: "0723.pdf" (this would merge all PDFs in the 0723.pdf folder)
 target_folder = "0723.pdf"
+# Number of page downloads kept in flight while merging
+download_concurrency = 8
+# Rebuild the cached folder index from a full bucket listing before showing folders
+# (needed only if pages were uploaded by something other than main.py)
+refresh_folder_index = False
+# Write the merged PDF to a temporary file before uploading instead of holding it in memory
+spill_merged_to_disk = True
+# "INFO" shows progress per phase, "DEBUG" lists every file as it is merged
+log_level = "INFO"
+# Local folder for the per-run JSON report (None to disable)
+metrics_report_dir = "run_reports"
+# Prometheus text file for node_exporter's textfile collector (None to disable)
+prometheus_textfile = None
 
 # --- Run the script ---
 if __name__ == "__main__":
-    print("🔧 PDF Merger for Object Storage")
-    print("=" * 50)
+    configure_logging(log_level)
+    logger.info("🔧 PDF Merger for Object Storage")
+    logger.info("=" * 50)
     
     # First, show available folders
-    print("Available folders:")
+    logger.info("Available folders:")
     available_folders = list_available_folders()
     
-    print("\n" + "=" * 50)
+    logger.info("\n" + "=" * 50)
     
     if target_folder:
-        print(f"🎯 Target folder: {target_folder}")
+        logger.info(f"🎯 Target folder: {target_folder}")
         merge_pdfs_from_folder(target_folder)
     else:
-        print("❌ Please set the 'target_folder' variable in the script")
-        print("Example: target_folder = '0723.pdf'")
+        logger.error("❌ Please set the 'target_folder' variable in the script")
+        logger.error("Example: target_folder = '0723.pdf'")
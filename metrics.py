@@ -0,0 +1,214 @@
+import contextlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Prefix of every metric name in the Prometheus text file
+PROMETHEUS_PREFIX = "magazine_refit"
+
+
+def configure_logging(level="INFO"):
+    """
+    Sends log records to stdout as bare messages, the way the scripts used to print them.
+    DEBUG adds the per-page and per-segment detail; WARNING keeps only problems.
+    """
+    logging.basicConfig(level=getattr(logging, str(level).upper(), logging.INFO), format="%(message)s")
+    # The HTTP clients log every request at INFO, which would drown the one line per phase
+    for name in ("httpx", "openai"):
+        logging.getLogger(name).setLevel(logging.WARNING)
+
+
+def _metric_name(name):
+    return re.sub(r"[^a-zA-Z0-9_]", "_", name)
+
+
+def _label_value(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", " ")
+
+
+def prometheus_text(reports):
+    """
+    Renders run reports (RunMetrics.report()) in the Prometheus text exposition format, as
+    gauges for the last run. Each run's samples carry its job name and labels, so the reports
+    of several documents can share one file; every metric's HELP and TYPE lines appear once.
+    """
+    families = {}  # Metric name -> (help text, sample lines)
+
+    def add(metric, help_text, labels, value):
+        families.setdefault(metric, (help_text, []))[1].append(f"{metric}{{{labels}}} {value}")
+
+    for report in reports:
+        labels = {'job_name': report['job'], **report['labels']}
+        base_labels = ",".join(f'{_metric_name(key)}="{_label_value(value)}"' for key, value in labels.items())
+        for name, stage in sorted(report['stages'].items()):
+            stage_labels = f'{base_labels},stage="{_label_value(name)}"'
+            add(f"{PROMETHEUS_PREFIX}_stage_seconds", "Seconds spent in each pipeline stage during the last run.",
+                stage_labels, f"{stage['seconds']:.6f}")
+            add(f"{PROMETHEUS_PREFIX}_stage_runs", "Times each pipeline stage ran during the last run.",
+                stage_labels, stage['count'])
+        for name, value in sorted(report['counters'].items()):
+            add(f"{PROMETHEUS_PREFIX}_{_metric_name(name)}", None, base_labels, value)
+        add(f"{PROMETHEUS_PREFIX}_run_seconds", None, base_labels, f"{report['elapsed']:.6f}")
+        started = time.mktime(time.strptime(report['started'], "%Y-%m-%dT%H:%M:%S"))
+        add(f"{PROMETHEUS_PREFIX}_last_run_timestamp_seconds", None, base_labels, f"{started:.0f}")
+
+    lines = []
+    for metric, (help_text, samples) in families.items():
+        if help_text:
+            lines.append(f"# HELP {metric} {help_text}")
+        lines.append(f"# TYPE {metric} gauge")
+        lines += samples
+    return "\n".join(lines) + "\n"
+
+
+def write_prometheus(path, reports):
+    """
+    Writes the reports to a Prometheus text file atomically, as node_exporter's textfile
+    collector expects. The file is replaced as a whole, so a batch of documents writes all
+    of its reports in one call rather than one file per document.
+    """
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    # Written next to the target and renamed over it, so the collector never reads half a file
+    temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temp_path, "w") as f:
+        f.write(prometheus_text(reports))
+    os.replace(temp_path, path)
+
+
+class RunMetrics:
+    """
+    Collects stage timings and counters for one run of a pipeline script.
+
+    Stages accumulate wall-clock seconds and how many times they ran, so per-page work done
+    on several threads (or reported back from render processes) adds up into one total.
+    Counters hold segment counts, retries, bytes and token usage. Safe to update from any thread.
+    `status` records how the run ended: "running" until the pipeline sets "done",
+    "skipped" (nothing left to do) or "failed".
+
+    Args:
+        job (str): Which pipeline produced the run, e.g. "translate" or "merge".
+        **labels: Identify the run in reports, e.g. document="0723.pdf".
+    """
+
+    def __init__(self, job, **labels):
+        self.job = job
+        self.labels = labels
+        self.started = time.time()
+        self._start = time.perf_counter()
+        self.stages = {}  # Stage name -> {'seconds': total, 'count': times run}
+        self.counters = {}
+        self.status = "running"
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """
+        Times the enclosed block and adds it to the named stage.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+    def add_time(self, name, seconds, count=1):
+        with self._lock:
+            stage = self.stages.setdefault(name, {'seconds': 0.0, 'count': 0})
+            stage['seconds'] += seconds
+            stage['count'] += count
+
+    def count(self, name, value=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def set(self, name, value):
+        with self._lock:
+            self.counters[name] = value
+
+    def add_usage(self, usage):
+        """
+        Adds the token counts from an OpenAI response's `usage` (ignored if missing).
+        """
+        if usage is None:
+            return
+        self.count('prompt_tokens', getattr(usage, 'prompt_tokens', 0) or 0)
+        self.count('completion_tokens', getattr(usage, 'completion_tokens', 0) or 0)
+        details = getattr(usage, 'completion_tokens_details', None)
+        reasoning_tokens = getattr(details, 'reasoning_tokens', 0) if details is not None else 0
+        if reasoning_tokens:
+            self.count('reasoning_tokens', reasoning_tokens)
+        cached_details = getattr(usage, 'prompt_tokens_details', None)
+        cached_tokens = getattr(cached_details, 'cached_tokens', 0) if cached_details is not None else 0
+        if cached_tokens:
+            self.count('cached_prompt_tokens', cached_tokens)
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self._start
+
+    def stage_seconds(self):
+        with self._lock:
+            return {name: stage['seconds'] for name, stage in self.stages.items()}
+
+    def report(self):
+        """
+        Returns the run as a JSON-serialisable dict.
+        """
+        with self._lock:
+            return {
+                'job': self.job,
+                'labels': dict(self.labels),
+                'status': self.status,
+                'started': time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.started)),
+                'elapsed': self.elapsed,
+                'stages': {name: dict(stage) for name, stage in self.stages.items()},
+                'counters': dict(self.counters),
+            }
+
+    def write_json(self, directory):
+        """
+        Writes the report to `<directory>/<job>_<labels>_<timestamp>.json` and returns the path.
+        """
+        os.makedirs(directory, exist_ok=True)
+        stamp = time.strftime("%Y%m%d_%H%M%S", time.localtime(self.started))
+        # Labels keep reports of documents that finish in the same second apart
+        name = "_".join([self.job] + [re.sub(r"[^A-Za-z0-9.-]+", "-", str(value)) for value in self.labels.values()])
+        path = os.path.join(directory, f"{name}_{stamp}.json")
+        with open(path, "w") as f:
+            json.dump(self.report(), f, indent=2)
+        return path
+
+    def prometheus_text(self):
+        """
+        Renders the run in the Prometheus text exposition format, see prometheus_text.
+        """
+        return prometheus_text([self.report()])
+
+    def write_prometheus(self, path):
+        """
+        Writes this run alone to the Prometheus text file, see write_prometheus.
+        """
+        write_prometheus(path, [self.report()])
+
+    def export(self, report_dir=None, prometheus_path=None):
+        """
+        Logs a one-line stage summary and writes whichever outputs are configured.
+        Export failures are logged, never raised, so they cannot fail a finished run.
+        """
+        stages = ", ".join(f"{name} {seconds:.2f}s" for name, seconds in self.stage_seconds().items())
+        logger.info(f"⏱️ Stages: {stages}")
+        try:
+            if report_dir:
+                logger.info(f"📝 Run report written to {self.write_json(report_dir)}")
+            if prometheus_path:
+                self.write_prometheus(prometheus_path)
+                logger.info(f"📝 Prometheus metrics written to {prometheus_path}")
+        except Exception as e:
+            logger.warning(f"⚠️ Could not write run metrics: {e}")
@@ -0,0 +1,475 @@
+import fitz  # PyMuPDF
+import io
+import logging
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+
+from text_fit import TextFitter
+
+logger = logging.getLogger(__name__)
+
+# MuPDF is not thread-safe. When several documents are processed on parallel threads,
+# every MuPDF call in this process takes this lock; rendering in worker processes does not.
+mupdf_lock = threading.RLock()
+
+
+# How the original text is removed before the translation is written:
+# "redact" deletes the text from the copied page's content stream in one pass,
+# "cover" embeds the page as a form XObject and paints a white box over every segment
+TEXT_REMOVAL_MODES = ("redact", "cover")
+
+
+def _redact_original_text(page, text_segments, translations):
+    """
+    Removes the source text of every translated segment with a single apply_redactions call.
+    Images and vector graphics are left untouched and no fill is painted, so backgrounds survive.
+
+    Each line is redacted through its glyph core ('redact_rects') rather than the segment
+    rect, which overlaps neighbouring lines under tight leading and would remove their text too.
+    """
+    redacted = 0
+    for i, segment in enumerate(text_segments):
+        if translations.get(str(i)):
+            for rect in segment.get('redact_rects', [segment['rect']]):
+                page.add_redact_annot(rect, fill=False, cross_out=False)
+            redacted += 1
+    if redacted:
+        page.apply_redactions(images=fitz.PDF_REDACT_IMAGE_NONE,
+                              graphics=fitz.PDF_REDACT_LINE_ART_NONE)
+    return redacted
+
+
+def render_page(original_doc, page_num, text_segments, translations, fitter,
+                text_removal="redact", stats=None):
+    """
+    Renders one translated page as its own single-page PDF and returns the PDF bytes.
+
+    Args:
+        original_doc (fitz.Document): The opened source document.
+        page_num (int): Zero-based page number in the source document.
+        text_segments (list): The page's extracted segments.
+        translations (dict): {"<segment index>": translated text} for this page.
+        fitter (TextFitter): Fitting engine holding the loaded regular and bold fonts.
+        text_removal (str): "redact" or "cover", see TEXT_REMOVAL_MODES.
+        stats (dict): If given, filled with 'render_seconds', 'save_seconds' and 'bytes'.
+    """
+    if text_removal not in TEXT_REMOVAL_MODES:
+        raise ValueError(f"Unknown text_removal '{text_removal}' (expected redact or cover)")
+    page = original_doc[page_num]
+    render_start = time.perf_counter()
+
+    # Create a new document for this single page
+    single_page_doc = fitz.open()
+    try:
+        if text_removal == "redact":
+            # Copy the page itself (content stream and resources) and strip the text in place
+            single_page_doc.insert_pdf(original_doc, from_page=page_num, to_page=page_num,
+                                       links=False, annots=False)
+            new_page = single_page_doc[0]
+            _redact_original_text(new_page, text_segments, translations)
+        else:
+            new_page = single_page_doc.new_page(width=page.rect.width, height=page.rect.height)
+            new_page.show_pdf_page(new_page.rect, original_doc, page_num)
+
+        if not text_segments:
+            logger.debug(f"      - No text segments found on page {page_num + 1}, creating empty translated page...")
+        else:
+            logger.debug(f"      - Page {page_num + 1}: {len(text_segments)} text segments, {len(translations)} translated")
+
+        # Apply translations to the page
+        for i, segment in enumerate(text_segments):
+            try:
+                # Get the translation for this segment
+                translated_text = translations.get(str(i))
+                if not translated_text:
+                    logger.debug(f"      - No translation found for segment {i}: '{segment['text'][:30]}...'")
+                    continue
+
+                # Step 1: In cover mode, draw a white/light background rectangle over the original text
+                if text_removal == "cover":
+                    # Expand the rectangle slightly to ensure full coverage
+                    cover_rect = fitz.Rect(
+                        segment['rect'].x0 - 1,  # Slightly expand left
+                        segment['rect'].y0 - 1,  # Slightly expand top
+                        segment['rect'].x1 + 1,  # Slightly expand right
+                        segment['rect'].y1 + 1   # Slightly expand bottom
+                    )
+
+                    # Draw white rectangle to cover original text
+                    new_page.draw_rect(cover_rect, color=None, fill=(1, 1, 1))  # White fill
+
+                # Step 2: Normalize color values to 0-1 range and ensure visible color
+                original_color = segment['color']
+                if isinstance(original_color, int):
+                    # Convert integer color to RGB tuple (0-1 range)
+                    r = ((original_color >> 16) & 255) / 255.0
+                    g = ((original_color >> 8) & 255) / 255.0
+                    b = (original_color & 255) / 255.0
+                    normalized_color = (r, g, b)
+                elif isinstance(original_color, (list, tuple)):
+                    # Ensure color components are in 0-1 range
+                    if len(original_color) >= 3:
+                        # Check if values are in 0-255 range and normalize
+                        if any(c > 1.0 for c in original_color[:3]):
+                            normalized_color = tuple(c / 255.0 for c in original_color[:3])
+                        else:
+                            normalized_color = tuple(original_color[:3])
+                    else:
+                        normalized_color = (0, 0, 0)  # Default to black
+                else:
+                    normalized_color = (0, 0, 0)  # Default to black
+
+                # Ensure the color is not white or too light (which would be invisible on white background)
+                if sum(normalized_color) > 2.7:  # If color is very light/white
+                    normalized_color = (0, 0, 0)  # Use black instead
+                    logger.debug(f"      - Changed white/light text to black for visibility")
+
+                # Step 3: Insert the translated text at the largest size that fits, in one insert
+                text_inserted = False
+                try:
+                    font_size, used_fallback = fitter.insert(
+                        new_page,
+                        segment['rect'],
+                        translated_text,
+                        bool(segment['is_bold']),
+                        normalized_color,
+                        segment['size'],
+                    )
+                    if used_fallback:
+                        logger.debug(f"      - Used fallback text insertion for segment {i}")
+                    elif abs(font_size - segment['size']) > 0.05:
+                        logger.debug(f"      - Text inserted with {int(font_size / segment['size'] * 100)}% font size for segment {i}")
+                    text_inserted = True
+                except Exception as insert_error:
+                    logger.warning(f"      - Text insertion failed for segment {i}: {insert_error}")
+                    logger.warning(f"        Original: '{segment['text'][:30]}...'")
+                    logger.warning(f"        Translation: '{translated_text[:30]}...'")
+
+                if text_inserted:
+                    if segment['is_bold']:
+                        logger.debug(f"      - Successfully inserted BOLD text for segment {i}")
+                    else:
+                        logger.debug(f"      - Successfully inserted text for segment {i}")
+                else:
+                    logger.warning(f"      - Failed to insert text for segment {i} - skipping")
+            except Exception as e:
+                logger.warning(f"      - Could not process segment {i}: '{segment['text'][:30]}...'. Error: {e}")
+
+        # Save to a temporary bytes buffer instead of local file
+        save_start = time.perf_counter()
+        pdf_bytes = io.BytesIO()
+        single_page_doc.save(pdf_bytes, garbage=4, deflate=True, clean=True)
+        if stats is not None:
+            stats['render_seconds'] = save_start - render_start
+            stats['save_seconds'] = time.perf_counter() - save_start
+            stats['bytes'] = pdf_bytes.getbuffer().nbytes
+        return pdf_bytes.getvalue()
+    finally:
+        single_page_doc.close()
+
+
+def benchmark_text_removal(source_path, page_segments, regular_font, bold_font):
+    """
+    Renders the same pages in both text removal modes and compares page size and save time.
+
+    Args:
+        source_path (str): Path of the source PDF.
+        page_segments (dict): {page_num: extracted text segments}.
+        regular_font (str): Path to the regular CJK font file.
+        bold_font (str): Path to the bold CJK font file.
+
+    Returns:
+        dict: {mode: {'bytes': total bytes, 'save_seconds': total, 'render_seconds': total}}
+    """
+    fitter = TextFitter(regular_font, bold_font)
+    results = {}
+    with fitz.open(source_path) as original_doc:
+        for mode in TEXT_REMOVAL_MODES:
+            totals = {'bytes': 0, 'save_seconds': 0.0, 'render_seconds': 0.0}
+            for page_num, text_segments in page_segments.items():
+                # Stand-in translation of similar length, so only the removal mode differs
+                translations = {str(i): "译" * max(1, len(segment['text']) // 2)
+                                for i, segment in enumerate(text_segments)}
+                stats = {}
+                render_page(original_doc, page_num, text_segments, translations, fitter,
+                            text_removal=mode, stats=stats)
+                for key in totals:
+                    totals[key] += stats[key]
+            results[mode] = totals
+
+    pages = max(1, len(page_segments))
+    for mode, totals in results.items():
+        print(f"📊 {mode:>6}: {totals['bytes'] / pages / 1024:8.1f} KB/page, "
+              f"save {totals['save_seconds'] / pages * 1000:7.1f} ms/page, "
+              f"render {totals['render_seconds'] / pages * 1000:7.1f} ms/page")
+    return results
+
+
+def copy_page(original_doc, page_num):
+    """
+    Copies one source page unchanged into its own single-page PDF and returns the bytes.
+    The page's existing content and image streams are copied as they are, without
+    re-rendering or recompressing anything.
+    """
+    single_page_doc = fitz.open()
+    try:
+        single_page_doc.insert_pdf(original_doc, from_page=page_num, to_page=page_num)
+        return single_page_doc.tobytes()
+    finally:
+        single_page_doc.close()
+
+
+def save_document_with_shared_fonts(doc, path):
+    """
+    Saves a document assembled from separately rendered pages so the CJK fonts are stored once.
+
+    Every rendered page embeds its own copy of the fonts. Saving with garbage=4 first
+    collapses those identical copies into one object, and only then are the fonts
+    subset to the glyphs used across the whole document.
+
+    Returns:
+        int: Size of the saved file in bytes.
+    """
+    deduplicated_path = f"{path}.dedup"
+    doc.save(deduplicated_path, garbage=4, deflate=True)
+    try:
+        with fitz.open(deduplicated_path) as deduplicated_doc:
+            deduplicated_doc.subset_fonts()
+            deduplicated_doc.save(path, garbage=4, deflate=True, clean=True)
+    finally:
+        os.remove(deduplicated_path)
+    return os.path.getsize(path)
+
+
+class AssembledDocument:
+    """
+    The single output document, built up page by page from separately rendered pages.
+
+    Every rendered page embeds its own full copy of the CJK fonts, so holding them all in
+    memory until save_document_with_shared_fonts grows by megabytes per page. Every
+    `compact_interval` inserted pages the document is saved to a temporary file with
+    identical objects merged (garbage=4) and reopened from there, leaving one copy of the
+    fonts instead of one per page (0 never compacts).
+    """
+
+    def __init__(self, compact_interval=0):
+        self.compact_interval = compact_interval
+        self.doc = fitz.open()
+        self.compactions = 0
+        self._pages_since_compact = 0
+        self._temp_dir = tempfile.mkdtemp(prefix="assembled-") if compact_interval else None
+
+    def insert_pdf(self, source, **kwargs):
+        page_count = len(self.doc)
+        self.doc.insert_pdf(source, **kwargs)
+        self._pages_since_compact += len(self.doc) - page_count
+        if self.compact_interval and self._pages_since_compact >= self.compact_interval:
+            self.compact()
+
+    def compact(self):
+        # Alternate between two files: the open document still reads from the previous one
+        path = os.path.join(self._temp_dir, f"assembled_{self.compactions % 2}.pdf")
+        self.doc.save(path, garbage=4, deflate=True)
+        self.doc.close()
+        fitz.TOOLS.store_shrink(100)
+        self.doc = fitz.open(path)
+        self.compactions += 1
+        self._pages_since_compact = 0
+
+    def save(self, path):
+        """
+        Saves the finished document with the fonts stored and subset once; returns its size in bytes.
+        """
+        return save_document_with_shared_fonts(self.doc, path)
+
+    def __len__(self):
+        return len(self.doc)
+
+    def close(self):
+        if not self.doc.is_closed:
+            self.doc.close()
+        if self._temp_dir:
+            shutil.rmtree(self._temp_dir, ignore_errors=True)
+
+
+class SourceDocument:
+    """
+    The source PDF opened by path, so MuPDF reads it from disk as needed instead of holding
+    the whole file in memory, and reopened every `recycle_interval` pages.
+
+    MuPDF keeps the fonts, images and objects it has decoded in a process-wide store; on a
+    very large issue that cache grows with every page visited. Reopening the document and
+    emptying the store every N pages keeps memory bounded (0 keeps it open throughout).
+    """
+
+    def __init__(self, path, recycle_interval=0):
+        self.path = path
+        self.recycle_interval = recycle_interval
+        self.doc = fitz.open(path)
+        self.page_count = self.doc.page_count
+        self.recycled = 0
+        self._pages_since_open = 0
+
+    def for_page(self):
+        """
+        Returns the open document to read the next page from, recycling it first if due.
+        """
+        if self.recycle_interval and self._pages_since_open >= self.recycle_interval:
+            self.doc.close()
+            fitz.TOOLS.store_shrink(100)
+            self.doc = fitz.open(self.path)
+            self._pages_since_open = 0
+            self.recycled += 1
+        self._pages_since_open += 1
+        return self.doc
+
+    def close(self):
+        # Safe to call again, e.g. from a cleanup path after an early close
+        if not self.doc.is_closed:
+            self.doc.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+# --- Multi-process rendering ---
+# Each worker process opens a source PDF on its first job for it and keeps it for later jobs
+_worker_state = {}
+# Source documents a worker keeps open at once when its pool is shared by several documents
+WORKER_OPEN_SOURCES = 2
+
+
+def _init_render_worker(regular_font, bold_font, text_removal, recycle_interval):
+    _worker_state['sources'] = OrderedDict()  # Source path -> SourceDocument, least recently used first
+    _worker_state['fitter'] = TextFitter(regular_font, bold_font)
+    _worker_state['text_removal'] = text_removal
+    _worker_state['recycle_interval'] = recycle_interval
+
+
+def _worker_source(source_path):
+    sources = _worker_state['sources']
+    source = sources.get(source_path)
+    if source is None:
+        while len(sources) >= WORKER_OPEN_SOURCES:
+            _, oldest = sources.popitem(last=False)
+            oldest.close()
+        source = sources[source_path] = SourceDocument(source_path, _worker_state['recycle_interval'])
+    sources.move_to_end(source_path)
+    return source
+
+
+def _render_job(job):
+    source_path, page_num, text_segments, translations = job
+    # Rects travel between processes as plain tuples
+    text_segments = [dict(segment, rect=fitz.Rect(segment['rect'])) for segment in text_segments]
+    stats = {}
+    pdf_bytes = render_page(_worker_source(source_path).for_page(), page_num, text_segments, translations,
+                            _worker_state['fitter'], _worker_state['text_removal'], stats)
+    return pdf_bytes, stats
+
+
+def create_render_pool(workers, regular_font, bold_font, text_removal="redact", recycle_interval=0):
+    """
+    Starts a pool of render processes that can be shared by several documents.
+    Pass it to render_pages as `pool`; the caller shuts it down when done.
+
+    Workers are spawned rather than forked: the pool is started from processes that already
+    run document, upload and translation threads, and a forked child could inherit a lock
+    (mupdf_lock, logging's) held by one of them and hang.
+    """
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                               initializer=_init_render_worker,
+                               initargs=(regular_font, bold_font, text_removal, recycle_interval))
+
+
+def render_pages(source_path, jobs, regular_font, bold_font, workers=1, text_removal="redact",
+                 recycle_interval=0, pool=None, max_pending=None):
+    """
+    Renders pages and yields (page_num, pdf_bytes, stats) in the same order as `jobs`,
+    where stats holds the page's render/save timings and size. A page that fails to render
+    yields pdf_bytes None and stats {'error': message}, and the remaining pages carry on.
+
+    Args:
+        source_path (str): Path of the source PDF; every worker opens it itself.
+        jobs (list): (page_num, text_segments, translations) tuples.
+        regular_font (str): Path to the regular CJK font file.
+        bold_font (str): Path to the bold CJK font file.
+        workers (int): Number of render processes (1 renders in this process).
+        text_removal (str): "redact" or "cover", see TEXT_REMOVAL_MODES.
+        recycle_interval (int): Reopen the source every N pages in each renderer, see SourceDocument.
+        pool: A pool from create_render_pool to render in; its own fonts and settings apply
+            and `workers` only sizes the submission window.
+        max_pending (int): Pages submitted ahead of the one the caller is consuming; defaults to
+            2 * workers. Finished pages wait in memory until consumed, so this bounds the
+            memory held when the caller (e.g. uploading) is slower than rendering.
+    """
+    if pool is None and workers <= 1:
+        with mupdf_lock:
+            fitter = TextFitter(regular_font, bold_font)
+            source = SourceDocument(source_path, recycle_interval)
+        try:
+            for page_num, text_segments, translations in jobs:
+                stats = {}
+                try:
+                    with mupdf_lock:
+                        pdf_bytes = render_page(source.for_page(), page_num, text_segments, translations, fitter,
+                                                text_removal, stats)
+                except Exception as e:
+                    pdf_bytes, stats = None, {'error': str(e)}
+                yield page_num, pdf_bytes, stats
+        finally:
+            with mupdf_lock:
+                source.close()
+        return
+
+    pickled_jobs = [
+        (source_path, page_num, [dict(segment, rect=tuple(segment['rect'])) for segment in text_segments],
+         translations)
+        for page_num, text_segments, translations in jobs
+    ]
+    own_pool = pool is None
+    if own_pool:
+        pool = create_render_pool(workers, regular_font, bold_font, text_removal, recycle_interval)
+    max_pending = max(1, max_pending or 2 * workers)
+    # Keep a bounded window of pages rendering ahead of the caller, like merge_pdfs' downloads
+    futures = deque()
+    next_index = 0
+    try:
+        for _, page_num, _, _ in pickled_jobs:
+            while next_index < len(pickled_jobs) and len(futures) < max_pending:
+                futures.append(pool.submit(_render_job, pickled_jobs[next_index]))
+                next_index += 1
+            # Collected in job order even though pages finish out of order
+            future = futures.popleft()
+            try:
+                pdf_bytes, stats = future.result()
+            except Exception as e:
+                pdf_bytes, stats = None, {'error': str(e)}
+            yield page_num, pdf_bytes, stats
+    finally:
+        # If the caller stopped early, do not leave its pages queued on a shared pool
+        for future in futures:
+            future.cancel()
+        if own_pool:
+            pool.shutdown()
+
+
+# --- Run the benchmark ---
+if __name__ == "__main__":
+    import sys
+    from main import extract_text_segments, font_path_bold, font_path_regular, input_pdf
+
+    benchmark_source = sys.argv[1] if len(sys.argv) > 1 else input_pdf
+    with fitz.open(benchmark_source) as benchmark_doc:
+        benchmark_segments = {page_num: extract_text_segments(benchmark_doc[page_num])
+                              for page_num in range(benchmark_doc.page_count)}
+    benchmark_text_removal(benchmark_source, benchmark_segments, font_path_regular, font_path_bold)
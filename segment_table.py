@@ -0,0 +1,63 @@
+from translation_cache import normalize_source_text
+
+
+class SegmentTable:
+    """
+    Document-level table of every extracted text segment.
+
+    Each segment is tagged with a 'text_id' pointing into the list of unique
+    (normalized) source texts, so repeated headers, footers and bylines are
+    translated once and resolved everywhere they appear.
+    """
+
+    def __init__(self):
+        self.pages = []  # Per page: list of segment dicts
+        self.texts = []  # Unique source texts, indexed by text_id
+        self._text_ids = {}  # Normalized text -> text_id
+
+    def add_page(self, text_segments):
+        """
+        Appends one page's segments, assigning each a shared text_id.
+        """
+        for segment in text_segments:
+            normalized = normalize_source_text(segment['text'])
+            text_id = self._text_ids.get(normalized)
+            if text_id is None:
+                text_id = len(self.texts)
+                self._text_ids[normalized] = text_id
+                self.texts.append(segment['text'])
+            segment['text_id'] = text_id
+        self.pages.append(text_segments)
+
+    @property
+    def total_segments(self):
+        return sum(len(text_segments) for text_segments in self.pages)
+
+    @property
+    def dedupe_ratio(self):
+        """
+        Fraction of segments that did not need their own translation.
+        """
+        total = self.total_segments
+        return 1 - len(self.texts) / total if total else 0.0
+
+    def unique_segments(self, page_nums=None):
+        """
+        Returns (text_id, segment) pairs for the unique texts, ready for batch packing.
+        If page_nums is given, only texts used on those pages are included.
+        """
+        if page_nums is None:
+            return [(text_id, {'text': text}) for text_id, text in enumerate(self.texts)]
+        needed = {segment['text_id'] for page_num in page_nums for segment in self.pages[page_num]}
+        return [(text_id, {'text': self.texts[text_id]}) for text_id in sorted(needed)]
+
+    def page_translations(self, page_num, resolved):
+        """
+        Maps a page's segment indices to translations from the resolved {text_id: translation} table.
+        """
+        translations = {}
+        for i, segment in enumerate(self.pages[page_num]):
+            translated_text = resolved.get(segment['text_id'])
+            if translated_text:
+                translations[str(i)] = translated_text
+        return translations
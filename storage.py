@@ -0,0 +1,384 @@
+import json
+import logging
+import os
+import queue
+import shutil
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Backend used when none is given explicitly: "replit", "local" or "memory"
+DEFAULT_BACKEND = os.environ.get("STORAGE_BACKEND", "replit")
+# Root folder for the local filesystem backend
+DEFAULT_LOCAL_ROOT = os.environ.get("LOCAL_STORAGE_ROOT", "local_storage")
+# Object holding the cached index of page folders
+FOLDER_INDEX_OBJECT = "_index/folders.json"
+
+
+class StoredObject:
+    """
+    Minimal listing entry with the same `.name` attribute as Replit's objects.
+    """
+
+    def __init__(self, name):
+        self.name = name
+
+    def __repr__(self):
+        return f"StoredObject({self.name!r})"
+
+
+class ReplitStorage:
+    """
+    Replit Object Storage, through `replit.object_storage.Client`.
+    """
+
+    def __init__(self, bucket_id=None):
+        from replit.object_storage import Client
+        self.client = Client(bucket_id) if bucket_id else Client()
+
+    def upload_from_bytes(self, name, data):
+        self.client.upload_from_bytes(name, data)
+
+    def upload_from_text(self, name, text):
+        self.client.upload_from_text(name, text)
+
+    def upload_from_filename(self, name, path):
+        self.client.upload_from_filename(name, path)
+
+    def download_as_bytes(self, name):
+        return self.client.download_as_bytes(name)
+
+    def download_as_text(self, name):
+        return self.client.download_as_text(name)
+
+    def download_to_filename(self, name, path):
+        self.client.download_to_filename(name, path)
+
+    def exists(self, name):
+        return self.client.exists(name)
+
+    def list(self, prefix=None):
+        if prefix:
+            return self.client.list(prefix=prefix)
+        return self.client.list()
+
+    def delete(self, name):
+        self.client.delete(name, ignore_not_found=True)
+
+
+class LocalStorage:
+    """
+    Stores objects as files under a root directory; object names map to relative paths.
+    """
+
+    def __init__(self, root=DEFAULT_LOCAL_ROOT):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, name):
+        return os.path.join(self.root, *name.split("/"))
+
+    def _prepare(self, name):
+        path = self._path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return path
+
+    def upload_from_bytes(self, name, data):
+        path = self._prepare(name)
+        # Write to a temporary name first so readers never see a half-written object
+        with open(f"{path}.part", "wb") as f:
+            f.write(data)
+        os.replace(f"{path}.part", path)
+
+    def upload_from_text(self, name, text):
+        self.upload_from_bytes(name, text.encode("utf-8"))
+
+    def upload_from_filename(self, name, path):
+        target = self._prepare(name)
+        shutil.copyfile(path, f"{target}.part")
+        os.replace(f"{target}.part", target)
+
+    def download_as_bytes(self, name):
+        with open(self._path(name), "rb") as f:
+            return f.read()
+
+    def download_as_text(self, name):
+        return self.download_as_bytes(name).decode("utf-8")
+
+    def download_to_filename(self, name, path):
+        shutil.copyfile(self._path(name), path)
+
+    def exists(self, name):
+        return os.path.isfile(self._path(name))
+
+    def list(self, prefix=None):
+        objects = []
+        # Only walk the directory the prefix pins down, not the whole root
+        base = self.root
+        if prefix and "/" in prefix:
+            base = self._path(prefix.rsplit("/", 1)[0])
+        for directory, _, filenames in os.walk(base):
+            for filename in filenames:
+                if filename.endswith(".part"):
+                    continue
+                name = os.path.relpath(os.path.join(directory, filename), self.root).replace(os.sep, "/")
+                if not prefix or name.startswith(prefix):
+                    objects.append(StoredObject(name))
+        return sorted(objects, key=lambda obj: obj.name)
+
+    def delete(self, name):
+        if self.exists(name):
+            os.remove(self._path(name))
+
+
+class MemoryStorage:
+    """
+    Keeps objects in a dict; for tests and offline benchmarks.
+    """
+
+    def __init__(self):
+        self.objects = {}
+        self._lock = threading.Lock()
+
+    def upload_from_bytes(self, name, data):
+        with self._lock:
+            self.objects[name] = bytes(data)
+
+    def upload_from_text(self, name, text):
+        self.upload_from_bytes(name, text.encode("utf-8"))
+
+    def upload_from_filename(self, name, path):
+        with open(path, "rb") as f:
+            self.upload_from_bytes(name, f.read())
+
+    def download_as_bytes(self, name):
+        with self._lock:
+            if name not in self.objects:
+                raise FileNotFoundError(name)
+            return self.objects[name]
+
+    def download_as_text(self, name):
+        return self.download_as_bytes(name).decode("utf-8")
+
+    def download_to_filename(self, name, path):
+        with open(path, "wb") as f:
+            f.write(self.download_as_bytes(name))
+
+    def exists(self, name):
+        with self._lock:
+            return name in self.objects
+
+    def list(self, prefix=None):
+        with self._lock:
+            names = sorted(self.objects)
+        return [StoredObject(name) for name in names if not prefix or name.startswith(prefix)]
+
+    def delete(self, name):
+        with self._lock:
+            self.objects.pop(name, None)
+
+
+def merged_object_name(folder):
+    """
+    Object name merge_pdfs.py gives the merged document of a page folder.
+    """
+    return f"{folder}/{folder}_merged.pdf"
+
+
+def is_page_object(name, folder):
+    return name.startswith(f"{folder}/") and name.endswith(".pdf") and name != merged_object_name(folder)
+
+
+def list_page_objects(storage, folder):
+    """
+    Lists the page PDFs stored under `folder/`, in page order, with a prefix listing
+    so the cost depends on the size of that one folder rather than the whole bucket.
+    """
+    objects = [obj for obj in storage.list(prefix=f"{folder}/") if is_page_object(obj.name, folder)]
+    return sorted(objects, key=lambda obj: obj.name)
+
+
+class FolderIndex:
+    """
+    Cached index of the page folders in a bucket, {folder: {"pages": n, "updated": time}},
+    kept as one small JSON object so listing folders does not scan every object.
+
+    main.py records a folder each time it uploads pages; `rebuild` recreates the index
+    from a full listing when it is missing or suspected stale.
+
+    Args:
+        storage: Any storage backend.
+        object_name (str): Where the index is stored.
+    """
+
+    # Documents finishing on parallel threads update the same index object
+    _lock = threading.Lock()
+
+    def __init__(self, storage, object_name=FOLDER_INDEX_OBJECT):
+        self.storage = storage
+        self.object_name = object_name
+
+    def load(self):
+        """
+        Returns the stored index, or None if there is none (or it cannot be read).
+        """
+        try:
+            if not self.storage.exists(self.object_name):
+                return None
+            return json.loads(self.storage.download_as_text(self.object_name))
+        except Exception as e:
+            logger.warning(f"⚠️ Could not read folder index '{self.object_name}': {e}")
+            return None
+
+    def save(self, folders):
+        self.storage.upload_from_text(self.object_name, json.dumps(folders, indent=1, sort_keys=True))
+
+    def rebuild(self):
+        """
+        Recreates the index from a full listing of the bucket.
+        """
+        folders = {}
+        for obj in self.storage.list():
+            if "/" not in obj.name:
+                continue
+            folder = obj.name.rsplit("/", 1)[0]
+            if is_page_object(obj.name, folder):
+                entry = folders.setdefault(folder, {"pages": 0, "updated": time.time()})
+                entry["pages"] += 1
+        with self._lock:
+            self.save(folders)
+        return folders
+
+    def folders(self, refresh=False):
+        """
+        Returns {folder: {"pages": n, "updated": time}}, rebuilding the index if it is missing.
+        """
+        folders = None if refresh else self.load()
+        return self.rebuild() if folders is None else folders
+
+    def record(self, folder, pages=None):
+        """
+        Records that `folder` now holds `pages` page objects (counted with a prefix listing
+        of the folder if not given). Failures are logged, never raised, since the index is
+        only a cache and can be rebuilt.
+        """
+        try:
+            if pages is None:
+                pages = len(list_page_objects(self.storage, folder))
+            with self._lock:
+                folders = self.load()
+                if folders is None:
+                    # No index yet: leave it to the first rebuild, which sees every folder
+                    return
+                folders[folder] = {"pages": pages, "updated": time.time()}
+                self.save(folders)
+        except Exception as e:
+            logger.warning(f"⚠️ Could not update folder index for '{folder}': {e}")
+
+
+def get_storage(backend=None, root=None):
+    """
+    Creates a storage backend by name.
+
+    Args:
+        backend (str): "replit", "local" or "memory"; defaults to the STORAGE_BACKEND environment variable.
+        root (str): Root directory for the local backend.
+    """
+    backend = backend or DEFAULT_BACKEND
+    if backend == "replit":
+        return ReplitStorage()
+    if backend == "local":
+        return LocalStorage(root or DEFAULT_LOCAL_ROOT)
+    if backend == "memory":
+        return MemoryStorage()
+    raise ValueError(f"Unknown storage backend '{backend}' (expected replit, local or memory)")
+
+
+class UploadQueue:
+    """
+    Uploads objects on background threads so the caller can keep rendering.
+
+    `submit` blocks once `max_pending` uploads are waiting, which bounds the memory
+    held by queued page bytes. Failed uploads are retried with exponential backoff.
+
+    Args:
+        storage: Any storage backend.
+        max_pending (int): Maximum uploads queued or in progress.
+        workers (int): Number of upload threads.
+        max_retries (int): Retries per object before it is reported as failed.
+    """
+
+    def __init__(self, storage, max_pending=8, workers=2, max_retries=3, retry_delay=1.0):
+        self.storage = storage
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self._queue = queue.Queue(maxsize=max(1, max_pending))
+        self._lock = threading.Lock()
+        self.uploaded = 0
+        self.bytes_uploaded = 0
+        self.retries = 0
+        self.upload_seconds = 0.0  # Summed across upload threads
+        self.failures = []  # (name, error message)
+        self._threads = [
+            threading.Thread(target=self._worker, name=f"upload-{i}", daemon=True)
+            for i in range(max(1, workers))
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, name, data, callback=None):
+        """
+        Queues `data` for upload as `name`. `callback(error)` runs on the upload
+        thread once the object is stored (error is None) or has finally failed.
+        """
+        self._queue.put((name, data, callback))
+
+    def _worker(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                self._queue.task_done()
+                return
+            name, data, callback = item
+            error = None
+            upload_start = time.perf_counter()
+            for attempt in range(self.max_retries + 1):
+                try:
+                    self.storage.upload_from_bytes(name, data)
+                    error = None
+                    break
+                except Exception as e:
+                    error = e
+                    if attempt < self.max_retries:
+                        with self._lock:
+                            self.retries += 1
+                        time.sleep(self.retry_delay * (2 ** attempt))
+            with self._lock:
+                self.upload_seconds += time.perf_counter() - upload_start
+                if error is None:
+                    self.uploaded += 1
+                    self.bytes_uploaded += len(data)
+                else:
+                    self.failures.append((name, str(error)))
+            if callback is not None:
+                try:
+                    callback(error)
+                except Exception as e:
+                    logger.error(f"      ❌ Upload callback for {name} failed: {e}")
+            self._queue.task_done()
+
+    def join(self):
+        """
+        Waits for every queued upload to finish.
+        """
+        self._queue.join()
+
+    def close(self):
+        """
+        Finishes the queued uploads and stops the worker threads.
+        """
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
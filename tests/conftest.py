@@ -0,0 +1,68 @@
+import os
+
+import fitz  # PyMuPDF
+import pytest
+
+# main creates its OpenAI client at import time; every test swaps in FakeOpenAIClient
+os.environ.setdefault("OPENAI_API_KEY", "test-key")
+
+PAGE_TEXTS = [
+    ["The summer issue", "Letter from the editor"],
+    ["Behind the scenes at the studio", "Photography by the team"],
+    ["City night guide", "Where to eat after the show"],
+]
+
+
+def write_magazine_pdf(path, page_texts):
+    """
+    Writes a PDF with one page per entry of `page_texts`, each a list of text lines.
+    """
+    doc = fitz.open()
+    for lines in page_texts:
+        page = doc.new_page(width=595, height=842)
+        for i, line in enumerate(lines):
+            page.insert_text((72, 100 + 40 * i), line, fontsize=12)
+    doc.save(path)
+    doc.close()
+
+
+@pytest.fixture(scope="session")
+def cjk_font(tmp_path_factory):
+    """
+    PyMuPDF's built-in CJK font written to a file, standing in for the Noto Sans SC fonts.
+    """
+    path = tmp_path_factory.mktemp("fonts") / "builtin-cjk.ttf"
+    path.write_bytes(fitz.Font("cjk").buffer)
+    return str(path)
+
+
+@pytest.fixture
+def pipeline(monkeypatch, tmp_path, cjk_font):
+    """
+    Runs main.translate_pdf_with_bolding on "issue.pdf" against MemoryStorage and FakeOpenAIClient.
+    Returns run(mode, page_texts=PAGE_TEXTS) -> report; run.storage holds the objects.
+    """
+    import main
+    from storage import MemoryStorage
+    from translation_scheduler import FakeOpenAIClient
+
+    monkeypatch.setattr(main, "client", FakeOpenAIClient(latency=0))
+    monkeypatch.setattr(main, "translation_cache_path", None)
+    monkeypatch.setattr(main, "render_workers", 1)
+    monkeypatch.setattr(main, "metrics_report_dir", None)
+    monkeypatch.setattr(main, "prometheus_textfile", None)
+    storage = MemoryStorage()
+
+    def run(mode, page_texts=PAGE_TEXTS):
+        source_path = tmp_path / "source.pdf"
+        write_magazine_pdf(source_path, page_texts)
+        storage.upload_from_filename("issue.pdf", str(source_path))
+        return main.translate_pdf_with_bolding("issue.pdf", "issue_zh.pdf", cjk_font, cjk_font,
+                                               mode=mode, storage_client=storage)
+
+    run.storage = storage
+    return run
+
+
+def page_objects(storage, folder="issue"):
+    return [name for name in sorted(storage.objects) if name.startswith(f"{folder}/page_")]
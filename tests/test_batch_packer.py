@@ -0,0 +1,36 @@
+from batch_packer import PROMPT_OVERHEAD_TOKENS, estimate_segment_tokens, pack_segments
+
+
+def _items(texts):
+    return [(f"key-{i}", {'text': text}) for i, text in enumerate(texts)]
+
+
+def test_keeps_document_order_and_keys():
+    items = _items([f"headline number {i}" for i in range(40)])
+    batches = pack_segments(items, input_token_budget=200, output_token_budget=200)
+    assert len(batches) > 1
+    assert [item for batch in batches for item in batch] == items
+
+
+def test_respects_max_segments():
+    batches = pack_segments(_items(["short"] * 25), max_segments=10)
+    assert [len(batch) for batch in batches] == [10, 10, 5]
+
+
+def test_batches_stay_within_token_budgets():
+    texts = [("word " * (5 + i % 30)).strip() for i in range(200)]
+    input_budget, output_budget = 600, 300
+    for batch in pack_segments(_items(texts), input_token_budget=input_budget, output_token_budget=output_budget):
+        costs = [estimate_segment_tokens(segment['text']) for _, segment in batch]
+        assert PROMPT_OVERHEAD_TOKENS + sum(cost[0] for cost in costs) <= input_budget
+        assert sum(cost[1] for cost in costs) <= output_budget
+
+
+def test_oversized_segment_gets_its_own_batch():
+    items = _items(["small", "huge " * 2000, "small again"])
+    batches = pack_segments(items, input_token_budget=500, output_token_budget=500)
+    assert [[key for key, _ in batch] for batch in batches] == [["key-0"], ["key-1"], ["key-2"]]
+
+
+def test_empty_input():
+    assert pack_segments([]) == []
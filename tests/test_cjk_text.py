@@ -0,0 +1,28 @@
+import main
+from cjk_text import han_share, is_cjk, is_han
+
+
+def test_chinese_text_is_all_han():
+    assert han_share("本期封面故事：城市夜生活指南") == 1.0
+
+
+def test_japanese_kana_lowers_the_han_share():
+    # Kanji are Han too, but kana make up most of ordinary Japanese text
+    assert han_share("今日はとても良い天気ですね") < 0.8
+    assert is_cjk("は") and not is_han("は")
+
+
+def test_korean_and_latin_text_have_no_han():
+    assert han_share("오늘의 특집 기사") == 0.0
+    assert han_share("The summer issue") == 0.0
+
+
+def test_punctuation_and_digits_are_not_counted():
+    assert han_share("2024 年 · 第 7 期！") == 1.0
+    assert han_share("12:30 — …") == 0.0
+
+
+def test_only_chinese_pages_are_passed_through_as_translated():
+    assert main.passthrough_reason([{'text': "本期封面故事"}, {'text': "城市夜生活指南"}]) == "already translated"
+    assert main.passthrough_reason([{'text': "今日はとても良い天気ですね"}]) is None
+    assert main.passthrough_reason([{'text': "오늘의 특집 기사"}]) is None
@@ -0,0 +1,98 @@
+import fitz  # PyMuPDF
+import pytest
+
+from conftest import PAGE_TEXTS, page_objects
+from job_manifest import JobManifest, page_content_hash
+from storage import MemoryStorage
+
+
+def _page_count(storage, name):
+    with fitz.open(stream=storage.download_as_bytes(name), filetype="pdf") as doc:
+        return doc.page_count
+
+
+@pytest.mark.parametrize("mode", ["single", "pages", "both"])
+def test_rerun_in_the_same_mode_has_nothing_to_do(pipeline, mode):
+    assert pipeline(mode)["status"] == "done"
+    assert pipeline(mode)["status"] == "skipped"
+
+
+def test_pages_after_single_writes_every_page(pipeline):
+    assert pipeline("single")["status"] == "done"
+    report = pipeline("pages")
+    assert report["status"] == "done"
+    assert report["counters"]["rendered_pages"] == 3
+    assert page_objects(pipeline.storage) == ["issue/page_001.pdf", "issue/page_002.pdf", "issue/page_003.pdf"]
+
+
+def test_both_after_single_renders_pages_instead_of_reusing_the_document(pipeline):
+    pipeline("single")
+    report = pipeline("both")
+    assert report["status"] == "done"
+    assert report["counters"]["rendered_pages"] == 3
+    assert len(page_objects(pipeline.storage)) == 3
+    assert _page_count(pipeline.storage, "issue_zh.pdf") == 3
+
+
+def test_both_after_pages_reuses_the_uploaded_pages(pipeline):
+    pipeline("pages")
+    report = pipeline("both")
+    assert report["status"] == "done"
+    assert report["counters"]["rendered_pages"] == 0
+    assert _page_count(pipeline.storage, "issue_zh.pdf") == 3
+
+
+def test_single_after_pages_still_writes_the_document(pipeline):
+    pipeline("pages")
+    assert not pipeline.storage.exists("issue_zh.pdf")
+    assert pipeline("single")["status"] == "done"
+    assert _page_count(pipeline.storage, "issue_zh.pdf") == 3
+
+
+def test_only_changed_pages_are_redone(pipeline):
+    pipeline("pages")
+    changed = [PAGE_TEXTS[0], ["A different feature story", "Interview with the editor"], PAGE_TEXTS[2]]
+    report = pipeline("pages", changed)
+    assert report["status"] == "done"
+    assert report["counters"]["rendered_pages"] == 1
+
+
+def test_manifest_only_accepts_the_pages_own_object():
+    manifest = JobManifest(MemoryStorage(), "issue/manifest.json", "issue.pdf")
+    # What a single-mode run used to record for every page
+    manifest.mark(0, "uploaded", "hash-0", object="issue_zh.pdf", untranslated=0)
+    assert not manifest.is_complete(0, "hash-0", "issue/page_001.pdf")
+    manifest.mark(0, "uploaded", "hash-0", object="issue/page_001.pdf", untranslated=0)
+    assert manifest.is_complete(0, "hash-0", "issue/page_001.pdf")
+    assert not manifest.is_complete(0, "hash-changed", "issue/page_001.pdf")
+
+
+def test_manifest_document_entry_tracks_every_page():
+    storage = MemoryStorage()
+    manifest = JobManifest(storage, "issue/manifest.json", "issue.pdf")
+    manifest.mark_document("issue_zh.pdf", "uploaded", ["a", "b"], untranslated=0)
+    manifest.save()
+    loaded = JobManifest.load(storage, "issue/manifest.json", "issue.pdf")
+    assert loaded.is_document_complete("issue_zh.pdf", ["a", "b"])
+    assert not loaded.is_document_complete("issue_zh.pdf", ["a", "c"])
+    assert not loaded.is_document_complete("other_zh.pdf", ["a", "b"])
+    assert loaded.counts() == {}
+
+
+def test_page_hash_covers_nested_form_xobjects():
+    source = fitz.open()
+    source.new_page().insert_text((72, 72), "Original caption")
+    doc = fitz.open()
+    page = doc.new_page()
+    # show_pdf_page draws the source page through two nested Form XObjects
+    page.show_pdf_page(page.rect, source, 0)
+    before = page_content_hash(doc, 0)
+    contents = page.read_contents()
+
+    inner = [xobject[0] for xobject in page.get_xobjects() if xobject[2] != 0]
+    assert inner
+    # Draw an extra rectangle inside the nested form only
+    doc.update_stream(inner[0], doc.xref_stream(inner[0]) + b"\n10 10 50 50 re f\n")
+
+    assert page.read_contents() == contents
+    assert page_content_hash(doc, 0) != before
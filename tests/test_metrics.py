@@ -0,0 +1,46 @@
+import batch_translate
+import main
+from conftest import write_magazine_pdf
+from metrics import RunMetrics, prometheus_text
+from storage import MemoryStorage
+from translation_scheduler import FakeOpenAIClient
+
+
+def _report(document, pages):
+    metrics = RunMetrics("translate", document=document)
+    metrics.add_time('render', 1.5)
+    metrics.count('pages', pages)
+    metrics.status = "done"
+    return metrics.report()
+
+
+def test_reports_share_one_file_with_each_family_declared_once():
+    text = prometheus_text([_report("a.pdf", 3), _report("b.pdf", 5)])
+    assert 'magazine_refit_pages{job_name="translate",document="a.pdf"} 3' in text
+    assert 'magazine_refit_pages{job_name="translate",document="b.pdf"} 5' in text
+    assert text.count("# TYPE magazine_refit_pages gauge") == 1
+    assert text.count("# TYPE magazine_refit_stage_seconds gauge") == 1
+
+
+def test_batch_writes_every_documents_metrics(monkeypatch, tmp_path, cjk_font):
+    prometheus_path = tmp_path / "magazine_refit.prom"
+    monkeypatch.setattr(main, "client", FakeOpenAIClient(latency=0))
+    monkeypatch.setattr(main, "translation_cache_path", None)
+    monkeypatch.setattr(main, "render_workers", 1)
+    monkeypatch.setattr(main, "metrics_report_dir", None)
+    monkeypatch.setattr(main, "prometheus_textfile", str(prometheus_path))
+    storage = MemoryStorage()
+    for name in ("one.pdf", "two.pdf", "three.pdf"):
+        source_path = tmp_path / name
+        write_magazine_pdf(source_path, [[f"Cover of {name}"], ["Contents page"]])
+        storage.upload_from_filename(name, str(source_path))
+
+    summaries = batch_translate.translate_documents(["one.pdf", "two.pdf", "three.pdf"], mode="pages",
+                                                    storage_client=storage, in_flight=3,
+                                                    regular_font=cjk_font, bold_font=cjk_font)
+
+    assert [summary["status"] for summary in summaries] == ["done", "done", "done"]
+    text = prometheus_path.read_text()
+    for name in ("one.pdf", "two.pdf", "three.pdf"):
+        assert f'magazine_refit_pages{{job_name="translate",document="{name}"}} 2' in text
+    assert list(tmp_path.glob("*.tmp")) == []
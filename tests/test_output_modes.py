@@ -0,0 +1,34 @@
+import fitz  # PyMuPDF
+
+import main
+from conftest import page_objects
+
+ALL_PAGES = ["issue/page_001.pdf", "issue/page_002.pdf", "issue/page_003.pdf"]
+
+
+def _page_count(storage, name):
+    with fitz.open(stream=storage.download_as_bytes(name), filetype="pdf") as doc:
+        return doc.page_count
+
+
+def test_default_mode_writes_pages():
+    assert main.output_mode == "pages"
+
+
+def test_pages_mode_writes_only_page_files(pipeline):
+    assert pipeline("pages")["status"] == "done"
+    assert page_objects(pipeline.storage) == ALL_PAGES
+    assert not pipeline.storage.exists("issue_zh.pdf")
+
+
+def test_single_mode_writes_only_the_document(pipeline):
+    assert pipeline("single")["status"] == "done"
+    assert page_objects(pipeline.storage) == []
+    assert _page_count(pipeline.storage, "issue_zh.pdf") == 3
+
+
+def test_both_mode_writes_pages_and_the_document(pipeline):
+    assert pipeline("both")["status"] == "done"
+    assert page_objects(pipeline.storage) == ALL_PAGES
+    assert _page_count(pipeline.storage, "issue_zh.pdf") == 3
+
@@ -0,0 +1,48 @@
+import json
+import tempfile
+import threading
+
+import page_renderer
+from conftest import page_objects
+
+
+def test_a_failing_page_is_marked_failed_and_the_rest_are_saved(pipeline, monkeypatch, tmp_path):
+    render_page = page_renderer.render_page
+
+    def failing_render_page(original_doc, page_num, *args, **kwargs):
+        if page_num == 1:
+            raise ValueError("corrupt page")
+        return render_page(original_doc, page_num, *args, **kwargs)
+
+    monkeypatch.setattr(page_renderer, "render_page", failing_render_page)
+    temp_dir = tmp_path / "temp"
+    temp_dir.mkdir()
+    monkeypatch.setattr(tempfile, "tempdir", str(temp_dir))
+
+    report = pipeline("both")
+
+    assert report["status"] == "failed"
+    assert page_objects(pipeline.storage) == ["issue/page_001.pdf", "issue/page_003.pdf"]
+    # The single document is not saved with a page missing
+    assert not pipeline.storage.exists("issue_zh.pdf")
+    pages = json.loads(pipeline.storage.download_as_text("issue/manifest.json"))["pages"]
+    assert {number: entry["state"] for number, entry in pages.items()} == {
+        "1": "uploaded", "2": "failed", "3": "uploaded"}
+    assert "corrupt page" in pages["2"]["error"]
+    # The downloaded source and the upload threads are cleaned up
+    assert list(temp_dir.iterdir()) == []
+    assert not [thread for thread in threading.enumerate() if thread.name.startswith("upload-")]
+
+
+def test_the_failed_page_is_redone_on_the_next_run(pipeline, monkeypatch):
+    render_page = page_renderer.render_page
+    monkeypatch.setattr(page_renderer, "render_page", lambda doc, page_num, *args, **kwargs: (
+        (_ for _ in ()).throw(ValueError("corrupt page")) if page_num == 1
+        else render_page(doc, page_num, *args, **kwargs)))
+    assert pipeline("pages")["status"] == "failed"
+
+    monkeypatch.setattr(page_renderer, "render_page", render_page)
+    report = pipeline("pages")
+    assert report["status"] == "done"
+    assert report["counters"]["rendered_pages"] == 1
+    assert len(page_objects(pipeline.storage)) == 3
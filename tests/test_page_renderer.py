@@ -0,0 +1,51 @@
+import fitz  # PyMuPDF
+import pytest
+
+import main
+from conftest import write_magazine_pdf
+from page_renderer import create_render_pool, render_page, render_pages
+from text_fit import TextFitter
+
+# Line height equal to the font size: each line's bbox reaches into its neighbours
+TIGHT_PARAGRAPH = ("<p style='font-size:12px;line-height:1.0'>First translated line here<br>"
+                   "<span style='color:red'>Red caption</span><br>Last translated line</p>")
+
+
+@pytest.fixture
+def tight_page():
+    doc = fitz.open()
+    doc.new_page().insert_htmlbox(fitz.Rect(72, 72, 400, 300), TIGHT_PARAGRAPH)
+    yield doc
+    doc.close()
+
+
+@pytest.mark.parametrize("grouping", ["line", "block"])
+def test_redaction_keeps_an_untranslated_neighbour(tight_page, cjk_font, grouping):
+    segments = main.extract_text_segments(tight_page[0], grouping)
+    texts = [segment['text'] for segment in segments]
+    assert "Red caption" in texts
+    # Every segment but the caption was translated
+    translations = {str(i): "译文" for i, text in enumerate(texts) if text != "Red caption"}
+
+    pdf_bytes = render_page(tight_page, 0, segments, translations, TextFitter(cjk_font, cjk_font))
+
+    with fitz.open(stream=pdf_bytes, filetype="pdf") as rendered:
+        text = rendered[0].get_text()
+    assert "Red caption" in text
+    assert "First translated line" not in text
+    assert "Last translated line" not in text
+
+
+def test_render_pool_spawns_its_workers(tmp_path, cjk_font):
+    source_path = tmp_path / "source.pdf"
+    write_magazine_pdf(source_path, [["The summer issue"], ["City night guide"]])
+    pool = create_render_pool(2, cjk_font, cjk_font)
+    try:
+        assert pool._mp_context.get_start_method() == "spawn"
+        with fitz.open(source_path) as doc:
+            jobs = [(page_num, main.extract_text_segments(doc[page_num]), {"0": "译文"}) for page_num in range(2)]
+        results = list(render_pages(str(source_path), jobs, cjk_font, cjk_font, pool=pool))
+    finally:
+        pool.shutdown()
+    assert [page_num for page_num, _, _ in results] == [0, 1]
+    assert all(pdf_bytes for _, pdf_bytes, _ in results)
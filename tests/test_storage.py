@@ -0,0 +1,73 @@
+import pytest
+
+from storage import FOLDER_INDEX_OBJECT, FolderIndex, LocalStorage, MemoryStorage, list_page_objects
+
+
+def _fill(storage):
+    for name in ("issue/page_001.pdf", "issue/page_002.pdf", "issue/manifest.json", "issue/issue_merged.pdf",
+                 "issues/page_001.pdf", "extra/deep/page_001.pdf", "cover.pdf"):
+        storage.upload_from_text(name, "x")
+
+
+@pytest.fixture(params=["local", "memory"])
+def storage(request, tmp_path):
+    storage = LocalStorage(str(tmp_path / "bucket")) if request.param == "local" else MemoryStorage()
+    _fill(storage)
+    return storage
+
+
+def test_list_with_a_prefix_only_returns_that_folder(storage):
+    assert [obj.name for obj in storage.list(prefix="issue/")] == [
+        "issue/issue_merged.pdf", "issue/manifest.json", "issue/page_001.pdf", "issue/page_002.pdf"]
+    assert [obj.name for obj in storage.list(prefix="issue")] == [
+        "issue/issue_merged.pdf", "issue/manifest.json", "issue/page_001.pdf", "issue/page_002.pdf",
+        "issues/page_001.pdf"]
+    assert [obj.name for obj in storage.list(prefix="extra/deep/")] == ["extra/deep/page_001.pdf"]
+    assert storage.list(prefix="missing/") == []
+    assert len(storage.list()) == 7
+
+
+def test_local_list_skips_partial_uploads(tmp_path):
+    storage = LocalStorage(str(tmp_path))
+    storage.upload_from_text("issue/page_001.pdf", "x")
+    (tmp_path / "issue" / "page_002.pdf.part").write_text("x")
+    assert [obj.name for obj in storage.list(prefix="issue/")] == ["issue/page_001.pdf"]
+
+
+def test_page_objects_leave_out_the_manifest_and_merged_document(storage):
+    assert [obj.name for obj in list_page_objects(storage, "issue")] == ["issue/page_001.pdf", "issue/page_002.pdf"]
+
+
+def test_folder_index_is_rebuilt_when_missing(storage):
+    index = FolderIndex(storage)
+    assert index.load() is None
+    folders = index.folders()
+    assert {folder: entry["pages"] for folder, entry in folders.items()} == {
+        "issue": 2, "issues": 1, "extra/deep": 1}
+    assert storage.exists(FOLDER_INDEX_OBJECT)
+    assert index.load() == folders
+
+
+def test_folder_index_records_new_folders(storage):
+    index = FolderIndex(storage)
+    index.rebuild()
+    storage.upload_from_text("summer/page_001.pdf", "x")
+    index.record("summer")
+    index.record("issue", pages=5)
+    folders = index.folders()
+    assert folders["summer"]["pages"] == 1
+    assert folders["issue"]["pages"] == 5
+
+
+def test_record_without_an_index_waits_for_the_first_rebuild(storage):
+    index = FolderIndex(storage)
+    index.record("issue")
+    assert not storage.exists(FOLDER_INDEX_OBJECT)
+
+
+def test_refresh_rebuilds_a_stale_index(storage):
+    index = FolderIndex(storage)
+    index.rebuild()
+    storage.upload_from_text("late/page_001.pdf", "x")
+    assert "late" not in index.folders()
+    assert index.folders(refresh=True)["late"]["pages"] == 1
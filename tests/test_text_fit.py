@@ -0,0 +1,45 @@
+import fitz  # PyMuPDF
+import pytest
+
+from text_fit import MIN_FONT_SCALE, TextFitter
+
+
+@pytest.fixture
+def fitter(cjk_font):
+    return TextFitter(cjk_font, cjk_font)
+
+
+def _text_bounds(page):
+    blocks = page.get_text("dict")["blocks"]
+    bounds = fitz.Rect()
+    for block in blocks:
+        for line in block["lines"]:
+            for span in line["spans"]:
+                bounds |= fitz.Rect(span["bbox"])
+    return bounds
+
+
+def test_text_that_fits_uses_the_normal_size_range(fitter):
+    doc = fitz.open()
+    page = doc.new_page()
+    rect = fitz.Rect(50, 50, 250, 80)
+    fontsize, fallback = fitter.insert(page, rect, "本期封面故事", False, (0, 0, 0), 12)
+    assert not fallback
+    assert fontsize >= 12 * MIN_FONT_SCALE
+    assert rect.contains(_text_bounds(page))
+    doc.close()
+
+
+def test_long_translation_is_shrunk_and_wrapped_inside_the_rect(fitter):
+    doc = fitz.open()
+    page = doc.new_page()
+    rect = fitz.Rect(50, 50, 270, 90)  # 220 x 40
+    text = "这是一段很长的正文翻译，需要在原始文本框内自动换行。" * 15  # 390 characters
+    fontsize, fallback = fitter.insert(page, rect, text, False, (0, 0, 0), 12)
+    assert fallback
+    assert fontsize < 12 * MIN_FONT_SCALE
+    bounds = _text_bounds(page)
+    # Glyph boxes can poke a fraction of a point past the line box
+    assert (rect + (-1, -1, 1, 1)).contains(bounds)
+    assert len(page.get_text().replace("\n", "")) == len(text)
+    doc.close()
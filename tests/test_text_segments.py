@@ -0,0 +1,34 @@
+import fitz  # PyMuPDF
+
+import main
+
+PARAGRAPH = ("<p style='font-size:12px'>A plain opening line of the paragraph<br>"
+             "continues here with a <b>bold</b> word inside<br>and ends on a plain line</p>")
+
+
+def _paragraph_page(doc, html):
+    page = doc.new_page()
+    page.insert_htmlbox(fitz.Rect(72, 72, 400, 300), html)
+    return page
+
+
+def test_block_grouping_joins_the_lines_of_a_paragraph():
+    doc = fitz.open()
+    page = _paragraph_page(doc, "<p style='font-size:12px'>A plain opening line<br>that carries on<br>and ends here</p>")
+    segments = main.extract_text_segments(page, "block")
+    assert [segment['text'] for segment in segments] == ["A plain opening line that carries on and ends here"]
+    doc.close()
+
+
+def test_block_segments_never_cover_an_inline_style_change():
+    doc = fitz.open()
+    page = _paragraph_page(doc, PARAGRAPH)
+    segments = main.extract_text_segments(page, "block")
+    assert "bold" in [segment['text'] for segment in segments]
+    # Lines share a little leading, but no segment may reach over another one's text
+    for segment in segments:
+        for other in segments:
+            if other is not segment:
+                center = (other['rect'].tl + other['rect'].br) / 2
+                assert not segment['rect'].contains(center), (segment['text'], other['text'])
+    doc.close()
@@ -0,0 +1,45 @@
+import itertools
+
+import pytest
+
+import translation_cache
+from translation_cache import TranslationCache
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    # A strictly increasing clock, so least-recently-used order never depends on timer resolution
+    clock = itertools.count(1)
+    monkeypatch.setattr(translation_cache.time, "time", lambda: float(next(clock)))
+    cache = TranslationCache(str(tmp_path / "cache.sqlite3"), "Simplified Chinese", "model-a", 1, max_entries=2)
+    yield cache
+    cache.close()
+
+
+def test_counts_hits_and_misses(cache):
+    cache.put_many({"Hello": "你好"})
+    assert cache.get_many(["Hello", "Goodbye"]) == {"Hello": "你好"}
+    assert cache.get_many(["  Hello "]) == {"  Hello ": "你好"}
+    assert cache.stats() == {"hits": 2, "misses": 1, "evictions": 0, "hit_rate": 2 / 3}
+
+
+def test_evicts_the_least_recently_used_entry(cache):
+    cache.put_many({"first": "一"})
+    cache.put_many({"second": "二"})
+    cache.get_many(["first"])  # Now more recently used than "second"
+    cache.put_many({"third": "三"})
+    assert cache.stats()["evictions"] == 1
+    assert cache.get_many(["first", "second", "third"]) == {"first": "一", "third": "三"}
+
+
+def test_entries_are_keyed_by_model_and_prompt_version(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    with_v1 = TranslationCache(path, "Simplified Chinese", "model-a", 1)
+    with_v1.put_many({"Hello": "你好"})
+    with_v1.close()
+    with_v2 = TranslationCache(path, "Simplified Chinese", "model-a", 2)
+    assert with_v2.get_many(["Hello"]) == {}
+    with_v2.close()
+    reopened = TranslationCache(path, "Simplified Chinese", "model-a", 1)
+    assert reopened.get_many(["Hello"]) == {"Hello": "你好"}
+    reopened.close()
@@ -0,0 +1,160 @@
+import functools
+import threading
+import time
+
+import main
+from translation_scheduler import FakeOpenAIClient, RateLimiter, TranslationScheduler, TruncatedResponseError
+
+
+def _segments(count):
+    return [{'text': f"segment text {i}"} for i in range(count)]
+
+
+class RateLimited(Exception):
+    status_code = 429
+
+
+class RecordingTranslator:
+    """
+    Translate function that records each request's texts and fails in configurable ways.
+    """
+
+    def __init__(self, truncate_above=None, drop_texts=(), drop_times=1, rate_limit_times=0, latency=0.0):
+        self.truncate_above = truncate_above
+        self.drop_texts = set(drop_texts)
+        self.drop_times = drop_times
+        self.rate_limit_times = rate_limit_times
+        self.latency = latency
+        self.requests = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._drops = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, batch):
+        with self._lock:
+            self.requests.append([segment['text'] for segment in batch])
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            time.sleep(self.latency)
+            with self._lock:
+                if self.rate_limit_times:
+                    self.rate_limit_times -= 1
+                    raise RateLimited()
+                if self.truncate_above is not None and len(batch) > self.truncate_above:
+                    raise TruncatedResponseError(f"{len(batch)} segments")
+                dropping = self._drops < self.drop_times and any(s['text'] in self.drop_texts for s in batch)
+                if dropping:
+                    self._drops += 1
+            return {
+                str(i): f"[zh] {segment['text']}" for i, segment in enumerate(batch)
+                if not (dropping and segment['text'] in self.drop_texts)
+            }
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+
+def _run(translator, batch, **options):
+    stats = TranslationScheduler.new_stats()
+    with TranslationScheduler(translator, max_in_flight=1, base_backoff=0.01, **options) as scheduler:
+        [result] = scheduler.translate_all([batch], stats=stats)
+    return result, stats
+
+
+def test_batches_run_concurrently_and_keep_their_order():
+    translator = RecordingTranslator(latency=0.05)
+    batches = [_segments(3) for _ in range(8)]
+    with TranslationScheduler(translator, max_in_flight=4) as scheduler:
+        results = scheduler.translate_all(batches)
+    assert results == [{str(i): f"[zh] segment text {i}" for i in range(3)}] * 8
+    assert 1 < translator.max_in_flight <= 4
+
+
+def test_rate_limited_request_is_retried():
+    translator = RecordingTranslator(rate_limit_times=2)
+    result, stats = _run(translator, _segments(3))
+    assert len(result) == 3
+    assert stats['rate_limited'] == 2
+    assert stats['requests'] == 3
+
+
+def test_rate_limit_retries_are_bounded():
+    translator = RecordingTranslator(rate_limit_times=100)
+    result, stats = _run(translator, _segments(3), max_retries=2, max_partial_retries=0)
+    assert result == {}
+    assert stats['requests'] == 3
+    assert stats['failed_batches'] == 1
+
+
+def test_per_call_stats_only_count_that_call():
+    translator = RecordingTranslator()
+    first, second = TranslationScheduler.new_stats(), TranslationScheduler.new_stats()
+    with TranslationScheduler(translator, max_in_flight=2) as scheduler:
+        scheduler.translate_all([_segments(2)], stats=first)
+        scheduler.translate_all([_segments(2), _segments(2)], stats=second)
+        assert (first['requests'], second['requests'], scheduler.stats['requests']) == (1, 2, 3)
+
+
+def test_rate_limiter_waits_for_the_window():
+    limiter = RateLimiter(requests_per_minute=2, window=0.2)
+    start = time.monotonic()
+    for _ in range(3):
+        limiter.acquire()
+    assert time.monotonic() - start >= 0.15
+
+
+def test_truncated_response_splits_the_batch():
+    translator = RecordingTranslator(truncate_above=2)
+    batch = _segments(8)
+    result, stats = _run(translator, batch, max_partial_retries=10)
+    assert result == {str(i): f"[zh] {segment['text']}" for i, segment in enumerate(batch)}
+    # 8 -> 4 + 4 -> 2 + 2 + 2 + 2
+    assert stats['splits'] == 3
+    assert stats['requests'] == 7
+    assert sorted(len(request) for request in translator.requests) == [2, 2, 2, 2, 4, 4, 8]
+
+
+def test_missing_ids_are_requested_again_on_their_own():
+    translator = RecordingTranslator(drop_texts={"segment text 1", "segment text 3"})
+    batch = _segments(5)
+    result, stats = _run(translator, batch)
+    assert len(result) == 5
+    assert result["3"] == "[zh] segment text 3"
+    assert translator.requests[1] == ["segment text 1", "segment text 3"]
+    assert stats['retried_segments'] == 2
+    assert stats['requests'] == 2
+    assert stats['missing_segments'] == 0
+
+
+def test_partial_retry_budget_is_bounded():
+    translator = RecordingTranslator(drop_texts={"segment text 0"}, drop_times=100)
+    result, stats = _run(translator, _segments(4), max_partial_retries=3)
+    assert "0" not in result and len(result) == 3
+    assert stats['requests'] == 1 + 3
+    assert stats['incomplete_batches'] == 1
+    assert stats['missing_segments'] == 1
+    assert stats['failed_batches'] == 0
+
+
+def test_truncation_without_budget_leaves_the_batch_untranslated():
+    translator = RecordingTranslator(truncate_above=1)
+    result, stats = _run(translator, _segments(8), max_partial_retries=2)
+    # Two splits (8 -> 4 + 4, 4 -> 2 + 2), then every part is still too long
+    assert result == {}
+    assert stats['splits'] == 2
+    assert stats['requests'] == 5
+    assert stats['failed_batches'] == 1
+    assert stats['missing_segments'] == 8
+
+
+def test_fake_client_end_to_end_through_openai_translate_function():
+    client = FakeOpenAIClient(latency=0, max_items=3, drop_rate=0.3, seed=7)
+    translate_fn = functools.partial(main.translate_batch_with_openai, openai_client=client, cache=False)
+    batch = _segments(10)
+    result, stats = _run(translate_fn, batch, max_partial_retries=20)
+    assert result == {str(i): f"[zh] {segment['text']}" for i, segment in enumerate(batch)}
+    assert stats['splits'] >= 2
+    assert stats['retried_segments'] > 0
+    assert client.calls == stats['requests']
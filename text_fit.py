@@ -0,0 +1,238 @@
+import fitz  # PyMuPDF
+import time
+from cjk_text import is_cjk
+
+# Same range the old retry loop tried: 120% of the original size down to 60%
+MAX_FONT_SCALE = 1.2
+MIN_FONT_SCALE = 0.6
+# Text that does not fit at the minimum scale keeps shrinking, down to this size in points
+MIN_FALLBACK_FONT_SIZE = 2.0
+
+
+def _tokenize(text):
+    """
+    Splits text into unbreakable pieces: each CJK character on its own, other words whole.
+    Spaces are kept as separate tokens so they can be dropped at line ends.
+    """
+    tokens = []
+    word = ""
+    for character in text:
+        if character == " " or is_cjk(character):
+            if word:
+                tokens.append(word)
+                word = ""
+            tokens.append(character)
+        else:
+            word += character
+    if word:
+        tokens.append(word)
+    return tokens
+
+
+class TextFitter:
+    """
+    Fits translated text into span rectangles analytically.
+
+    The regular and bold fonts are loaded once as fitz.Font objects and glyph
+    advances are cached, so the largest font size that fits a rectangle can be
+    computed directly and each span is written with a single insert.
+
+    Args:
+        regular_font (str): Path to the regular CJK font file.
+        bold_font (str): Path to the bold CJK font file.
+    """
+
+    def __init__(self, regular_font, bold_font):
+        regular = fitz.Font(fontfile=regular_font)
+        bold = regular if bold_font == regular_font else fitz.Font(fontfile=bold_font)
+        self.fonts = {False: regular, True: bold}
+        self._advances = {False: {}, True: {}}
+
+    def _token_width(self, token, bold):
+        """
+        Width of a token at font size 1, from cached per-glyph advances.
+        """
+        advances = self._advances[bold]
+        width = 0.0
+        for character in token:
+            advance = advances.get(character)
+            if advance is None:
+                advance = self.fonts[bold].glyph_advance(ord(character))
+                advances[character] = advance
+            width += advance
+        return width
+
+    def line_height(self, bold):
+        font = self.fonts[bold]
+        return font.ascender - font.descender
+
+    def wrap(self, text, bold, fontsize, max_width):
+        """
+        Greedily wraps text into lines no wider than max_width at the given font size.
+        """
+        limit = max_width / fontsize
+        lines = []
+        line = ""
+        line_width = 0.0
+        for token in _tokenize(text):
+            token_width = self._token_width(token, bold)
+            if line and line_width + token_width > limit:
+                lines.append(line.rstrip())
+                line, line_width = "", 0.0
+            if token == " " and not line:
+                continue  # No leading spaces on a wrapped line
+            if token_width > limit and not line:
+                # A single word wider than the box: break it by character
+                for character in token:
+                    character_width = self._token_width(character, bold)
+                    if line and line_width + character_width > limit:
+                        lines.append(line)
+                        line, line_width = "", 0.0
+                    line += character
+                    line_width += character_width
+                continue
+            line += token
+            line_width += token_width
+        if line.strip():
+            lines.append(line.rstrip())
+        return lines
+
+    def _fits(self, text, bold, fontsize, rect):
+        lines = self.wrap(text, bold, fontsize, rect.width)
+        return len(lines) * fontsize * self.line_height(bold) <= rect.height, lines
+
+    def fit(self, text, rect, bold, original_size):
+        """
+        Finds the largest font size between MIN_FONT_SCALE and MAX_FONT_SCALE of the
+        original size at which the wrapped text fits inside rect.
+
+        Returns:
+            tuple: (fontsize, lines), or (None, None) if it does not fit even at the minimum.
+        """
+        low = original_size * MIN_FONT_SCALE
+        high = original_size * MAX_FONT_SCALE
+        fits, lines = self._fits(text, bold, high, rect)
+        if fits:
+            return high, lines
+        fits, best_lines = self._fits(text, bold, low, rect)
+        if not fits:
+            return None, None
+        best_size = low
+        # Binary search to a tenth of a point
+        while high - low > 0.1:
+            middle = (low + high) / 2
+            fits, lines = self._fits(text, bold, middle, rect)
+            if fits:
+                best_size, best_lines = middle, lines
+                low = middle
+            else:
+                high = middle
+        return best_size, best_lines
+
+    def shrink_to_fit(self, text, rect, bold, original_size):
+        """
+        Finds the largest font size between MIN_FALLBACK_FONT_SIZE and the minimum scale at
+        which the wrapped text fits inside rect, for text too long for the normal range.
+        At MIN_FALLBACK_FONT_SIZE the lines that would overflow the bottom of rect are dropped.
+
+        Returns:
+            tuple: (fontsize, lines)
+        """
+        high = original_size * MIN_FONT_SCALE
+        low = min(MIN_FALLBACK_FONT_SIZE, high)
+        fits, best_lines = self._fits(text, bold, low, rect)
+        if not fits:
+            max_lines = max(1, int(rect.height // (low * self.line_height(bold))))
+            return low, best_lines[:max_lines]
+        best_size = low
+        while high - low > 0.1:
+            middle = (low + high) / 2
+            fits, lines = self._fits(text, bold, middle, rect)
+            if fits:
+                best_size, best_lines = middle, lines
+                low = middle
+            else:
+                high = middle
+        return best_size, best_lines
+
+    def insert(self, page, rect, text, bold, color, original_size):
+        """
+        Writes text into rect with one TextWriter call, at the largest size that fits.
+        Falls back to shrinking below MIN_FONT_SCALE when nothing in the normal range fits,
+        so the text stays wrapped inside rect.
+
+        Returns:
+            tuple: (font size used, True if the fallback was used)
+        """
+        font = self.fonts[bold]
+        fontsize, lines = self.fit(text, rect, bold, original_size)
+        fallback = fontsize is None
+        if fallback:
+            fontsize, lines = self.shrink_to_fit(text, rect, bold, original_size)
+        writer = fitz.TextWriter(page.rect)
+        line_step = fontsize * self.line_height(bold)
+        baseline = rect.y0 + fontsize * font.ascender
+        for line in lines:
+            writer.append((rect.x0, baseline), line, font=font, fontsize=fontsize)
+            baseline += line_step
+        writer.write_text(page, color=color)
+        return fontsize, fallback
+
+
+def _insert_with_retry_loop(page, rect, text, font_name, font_file, original_size, color):
+    """
+    The previous approach, kept for benchmarking: try insert_textbox at shrinking scales.
+    """
+    for font_scale in [1.2, 1.0, 0.9, 0.8, 0.7, 0.6]:
+        try:
+            result = page.insert_textbox(rect, text, fontname=font_name, fontfile=font_file,
+                                         fontsize=original_size * font_scale, color=color,
+                                         align=fitz.TEXT_ALIGN_LEFT)
+            if result >= 0:
+                return
+        except Exception:
+            continue
+    page.insert_text((rect.x0, rect.y0 + rect.height * 0.8), text, fontname=font_name,
+                     fontfile=font_file, fontsize=original_size * 0.8, color=color)
+
+
+def benchmark_fitting(regular_font, bold_font, spans=300):
+    """
+    Micro-benchmark: spans/second of the old insert_textbox retry loop versus TextFitter.
+    """
+    samples = [
+        ("本期封面故事", fitz.Rect(0, 0, 200, 24), 18),
+        ("这是一段较长的正文翻译，需要在原始文本框内自动换行并尽量保持字号。", fitz.Rect(0, 0, 240, 40), 10),
+        ("摄影 · 约翰 Smith", fitz.Rect(0, 0, 90, 10), 8),
+    ]
+    results = {}
+
+    start = time.perf_counter()
+    doc = fitz.open()
+    page = doc.new_page()
+    for i in range(spans):
+        text, rect, size = samples[i % len(samples)]
+        _insert_with_retry_loop(page, rect + (0, (i % 30) * 26, 0, (i % 30) * 26), text,
+                                "china-font-regular", regular_font, size, (0, 0, 0))
+    doc.close()
+    results["retry_loop"] = spans / (time.perf_counter() - start)
+
+    start = time.perf_counter()
+    fitter = TextFitter(regular_font, bold_font)
+    doc = fitz.open()
+    page = doc.new_page()
+    for i in range(spans):
+        text, rect, size = samples[i % len(samples)]
+        fitter.insert(page, rect + (0, (i % 30) * 26, 0, (i % 30) * 26), text, False, (0, 0, 0), size)
+    doc.close()
+    results["text_fitter"] = spans / (time.perf_counter() - start)
+
+    print(f"📊 insert_textbox retry loop: {results['retry_loop']:8.1f} spans/s")
+    print(f"📊 TextFitter (one insert):   {results['text_fitter']:8.1f} spans/s "
+          f"({results['text_fitter'] / results['retry_loop']:.1f}x)")
+    return results
+
+
+# --- Run the benchmark ---
+if __name__ == "__main__":
+    benchmark_fitting("NotoSansSC-Regular.ttf", "NotoSansSC-Bold.ttf")
@@ -0,0 +1,129 @@
+import hashlib
+import sqlite3
+import threading
+import time
+import unicodedata
+
+
+def normalize_source_text(text):
+    """
+    Normalizes text before hashing so trivial whitespace/Unicode differences share a cache entry.
+    """
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+def translation_key(text, target_language, model, prompt_version):
+    """
+    Content address of one translation: hash of normalized source text + language + model + prompt version.
+    """
+    material = "\x1f".join([normalize_source_text(text), target_language, model, str(prompt_version)])
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+class TranslationCache:
+    """
+    Persistent on-disk translation memory backed by SQLite.
+
+    Args:
+        path (str): SQLite database file (created if missing).
+        target_language (str): Language the cached translations are in.
+        model (str): Model name that produced the translations.
+        prompt_version (int): Bump whenever the prompt changes to invalidate old entries.
+        max_entries (int): Least recently used entries are evicted above this size.
+    """
+
+    def __init__(self, path, target_language, model, prompt_version, max_entries=200000):
+        self.path = path
+        self.target_language = target_language
+        self.model = model
+        self.prompt_version = prompt_version
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # The scheduler calls in from several threads, so share one connection behind a lock
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            """CREATE TABLE IF NOT EXISTS translations (
+                   key TEXT PRIMARY KEY,
+                   source TEXT NOT NULL,
+                   translation TEXT NOT NULL,
+                   last_used REAL NOT NULL
+               )"""
+        )
+        self._connection.execute(
+            "CREATE INDEX IF NOT EXISTS translations_last_used ON translations (last_used)"
+        )
+        self._connection.commit()
+
+    def _key(self, text):
+        return translation_key(text, self.target_language, self.model, self.prompt_version)
+
+    def get_many(self, texts):
+        """
+        Looks up several source texts at once. Returns {text: translation} for the hits.
+        """
+        keys = {self._key(text): text for text in texts}
+        found = {}
+        if not keys:
+            return found
+        with self._lock:
+            rows = []
+            key_list = list(keys)
+            # Stay well under SQLite's bound-parameter limit
+            for start in range(0, len(key_list), 500):
+                chunk = key_list[start:start + 500]
+                placeholders = ",".join("?" * len(chunk))
+                rows.extend(self._connection.execute(
+                    f"SELECT key, translation FROM translations WHERE key IN ({placeholders})", chunk
+                ).fetchall())
+            now = time.time()
+            self._connection.executemany(
+                "UPDATE translations SET last_used = ? WHERE key = ?", [(now, key) for key, _ in rows]
+            )
+            self._connection.commit()
+            for key, translation in rows:
+                found[keys[key]] = translation
+            self.hits += len(found)
+            self.misses += len(set(keys.values())) - len(found)
+        return found
+
+    def put_many(self, translations):
+        """
+        Stores {source text: translation} pairs and evicts the least recently used overflow.
+        """
+        if not translations:
+            return
+        now = time.time()
+        with self._lock:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO translations (key, source, translation, last_used) VALUES (?, ?, ?, ?)",
+                [(self._key(text), text, translation, now) for text, translation in translations.items()]
+            )
+            count = self._connection.execute("SELECT COUNT(*) FROM translations").fetchone()[0]
+            overflow = count - self.max_entries
+            if overflow > 0:
+                self._connection.execute(
+                    "DELETE FROM translations WHERE key IN "
+                    "(SELECT key FROM translations ORDER BY last_used LIMIT ?)", (overflow,)
+                )
+                self.evictions += overflow
+            self._connection.commit()
+
+    def stats(self):
+        """
+        Returns hit/miss counters for this process.
+        """
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
@@ -0,0 +1,370 @@
+import json
+import logging
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from batch_packer import estimate_batch_tokens
+
+logger = logging.getLogger(__name__)
+
+
+def is_rate_limit_error(error):
+    """
+    Returns True if the exception looks like an HTTP 429 from the API.
+    """
+    return getattr(error, "status_code", None) == 429
+
+
+def retry_after_seconds(error):
+    """
+    Reads the Retry-After header from a rate limit error, if the server sent one.
+    """
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+class RateLimiter:
+    """
+    Sliding one-minute window limiter for requests-per-minute and tokens-per-minute budgets.
+    A budget of None means unlimited.
+    """
+
+    def __init__(self, requests_per_minute=None, tokens_per_minute=None, window=60.0):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.window = window
+        self._events = deque()  # (timestamp, tokens)
+        self._tokens_in_window = 0
+        self._lock = threading.Lock()
+
+    def _expire(self, now):
+        while self._events and now - self._events[0][0] >= self.window:
+            _, tokens = self._events.popleft()
+            self._tokens_in_window -= tokens
+
+    def acquire(self, tokens=0):
+        """
+        Blocks until one request of `tokens` tokens fits in both budgets, then records it.
+        """
+        if self.tokens_per_minute:
+            # A single oversized request must still be allowed through eventually
+            tokens = min(tokens, self.tokens_per_minute)
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._expire(now)
+                requests_ok = (not self.requests_per_minute
+                               or len(self._events) < self.requests_per_minute)
+                tokens_ok = (not self.tokens_per_minute
+                             or self._tokens_in_window + tokens <= self.tokens_per_minute)
+                if requests_ok and tokens_ok:
+                    self._events.append((now, tokens))
+                    self._tokens_in_window += tokens
+                    return
+                # Sleep until the oldest request leaves the window
+                wait = self.window - (now - self._events[0][0]) if self._events else 0.05
+            time.sleep(max(wait, 0.01))
+
+
+class TruncatedResponseError(Exception):
+    """
+    Raised by a translate function when the model stopped at its output-token limit
+    (or returned nothing), so the batch should be split rather than retried as is.
+    """
+
+
+class TranslationScheduler:
+    """
+    Keeps several translation batches in flight at once while honoring the
+    requests-per-minute / tokens-per-minute budgets and backing off on 429s.
+
+    Each response is validated: ids missing from it are re-requested on their own,
+    and a batch that hits the output-token limit is split in half, both within a
+    bounded per-batch retry budget.
+
+    One scheduler can be shared by several documents: each call to `submit` or
+    `translate_all` may pass its own translate function and a stats dict that receives
+    that call's share of the counters, while the budgets and `stats` stay global.
+
+    Args:
+        translate_fn (callable): Takes a list of segments, returns {"<local id>": translation}.
+        max_in_flight (int): Number of batches sent concurrently (1 = the old sequential path).
+        requests_per_minute (int): RPM budget, or None for unlimited.
+        tokens_per_minute (int): TPM budget, or None for unlimited.
+        max_retries (int): How many times a rate-limited request is retried before giving up.
+        max_partial_retries (int): Extra requests (re-requests of missing ids or splits) allowed per batch.
+    """
+
+    def __init__(self, translate_fn, max_in_flight=4, requests_per_minute=None,
+                 tokens_per_minute=None, max_retries=6, base_backoff=1.0, max_backoff=60.0,
+                 token_estimator=estimate_batch_tokens, max_partial_retries=4):
+        self.translate_fn = translate_fn
+        self.max_in_flight = max(1, max_in_flight)
+        self.rate_limiter = RateLimiter(requests_per_minute, tokens_per_minute)
+        self.max_retries = max_retries
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.token_estimator = token_estimator
+        self.max_partial_retries = max_partial_retries
+        self._executor = ThreadPoolExecutor(max_workers=self.max_in_flight,
+                                            thread_name_prefix="translate")
+        self._stats_lock = threading.Lock()
+        self.stats = self.new_stats()
+
+    @staticmethod
+    def new_stats():
+        """
+        Returns a zeroed stats dict, e.g. to collect one document's counters.
+        """
+        return {
+            "batches": 0,
+            "requests": 0,
+            "segments": 0,
+            "rate_limited": 0,
+            "failed_batches": 0,
+            "retried_segments": 0,
+            "splits": 0,
+            "incomplete_batches": 0,
+            "missing_segments": 0,
+        }
+
+    def _count(self, key, amount=1, call_stats=None):
+        with self._stats_lock:
+            self.stats[key] += amount
+            if call_stats is not None:
+                call_stats[key] += amount
+
+    def _request(self, batch, translate_fn, call_stats):
+        """
+        Sends one request, waiting for rate-limit budget and backing off on 429s.
+        TruncatedResponseError is passed through to the caller.
+        """
+        estimated_tokens = self.token_estimator(batch)
+        attempt = 0
+        while True:
+            self.rate_limiter.acquire(estimated_tokens)
+            try:
+                self._count("requests", call_stats=call_stats)
+                return translate_fn(batch)
+            except TruncatedResponseError:
+                raise
+            except Exception as e:
+                if not is_rate_limit_error(e) or attempt >= self.max_retries:
+                    logger.warning(f"      - Request failed after {attempt + 1} attempt(s): {e}")
+                    return {}
+                self._count("rate_limited", call_stats=call_stats)
+                delay = retry_after_seconds(e)
+                if delay is None:
+                    delay = min(self.max_backoff, self.base_backoff * (2 ** attempt))
+                    delay *= random.uniform(0.5, 1.0)  # Jitter so workers don't retry in lockstep
+                logger.debug(f"      - Rate limited (429), retrying in {delay:.1f}s...")
+                time.sleep(delay)
+                attempt += 1
+
+    def _run_batch(self, batch, translate_fn, call_stats):
+        results = {}
+        budget = self.max_partial_retries
+        retried = 0
+        splits = 0
+        # Each work item is a list of indices into `batch` still to be translated
+        work = [list(range(len(batch)))]
+        while work:
+            ids = work.pop()
+            try:
+                response = self._request([batch[i] for i in ids], translate_fn, call_stats)
+            except TruncatedResponseError:
+                if len(ids) > 1 and budget > 0:
+                    # Output-token limit hit: split the request in half and try both parts
+                    budget -= 1
+                    splits += 1
+                    middle = len(ids) // 2
+                    work.append(ids[middle:])
+                    work.append(ids[:middle])
+                else:
+                    logger.warning(f"      - Response truncated for {len(ids)} segment(s), no retry budget left")
+                continue
+
+            # Map request-local ids back to batch ids and re-request only what is missing
+            for local_id, i in enumerate(ids):
+                value = response.get(str(local_id))
+                if value:
+                    results[str(i)] = value
+            missing = [i for i in ids if str(i) not in results]
+            if missing and budget > 0:
+                budget -= 1
+                retried += len(missing)
+                work.append(missing)
+
+        missing_count = len(batch) - len(results)
+        with self._stats_lock:
+            for stats in (self.stats, call_stats):
+                if stats is None:
+                    continue
+                stats["batches"] += 1
+                stats["segments"] += len(results)
+                stats["retried_segments"] += retried
+                stats["splits"] += splits
+                if missing_count:
+                    stats["incomplete_batches"] += 1
+                    stats["missing_segments"] += missing_count
+                if not results and batch:
+                    stats["failed_batches"] += 1
+        if retried or splits or missing_count:
+            logger.debug(f"      - Batch of {len(batch)}: {retried} segment(s) re-requested, {splits} split(s), "
+                         f"{missing_count} still untranslated")
+        return results
+
+    def submit(self, batch, translate_fn=None, stats=None):
+        """
+        Queues one batch and returns a Future resolving to its {"<local id>": translation} dict.
+
+        Args:
+            translate_fn (callable): Used for this batch instead of the scheduler's translate_fn.
+            stats (dict): Also receives this batch's counters (see new_stats).
+        """
+        return self._executor.submit(self._run_batch, batch, translate_fn or self.translate_fn, stats)
+
+    def translate_all(self, batches, translate_fn=None, stats=None):
+        """
+        Translates a list of batches and returns their results in the same order.
+        translate_fn and stats apply to every batch, as in `submit`.
+        """
+        futures = [self.submit(batch, translate_fn, stats) for batch in batches]
+        return [future.result() for future in futures]
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+
+
+# --- Local fake client for testing without spending API money ---
+
+class _FakeMessage:
+    def __init__(self, content):
+        self.content = content
+
+
+class _FakeChoice:
+    def __init__(self, content, finish_reason):
+        self.message = _FakeMessage(content)
+        self.finish_reason = finish_reason
+
+
+class _FakeResponse:
+    def __init__(self, content, finish_reason="stop"):
+        self.choices = [_FakeChoice(content, finish_reason)]
+        self.usage = None
+
+
+class FakeOpenAIClient:
+    """
+    Stands in for `OpenAI()` with the same `client.chat.completions.create(...)` surface.
+    Each call sleeps `latency` seconds and "translates" by tagging the input text.
+    A fraction `rate_limit_rate` of calls raise a 429 like the real API does, requests
+    with more than `max_items` texts come back empty with finish_reason "length", and
+    a fraction `drop_rate` of ids are left out of otherwise good responses.
+    """
+
+    def __init__(self, latency=0.5, rate_limit_rate=0.0, max_items=None, drop_rate=0.0, seed=None):
+        self.latency = latency
+        self.rate_limit_rate = rate_limit_rate
+        self.max_items = max_items
+        self.drop_rate = drop_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.chat = self
+        self.completions = self
+
+    def _rate_limit_error(self):
+        import httpx
+        from openai import RateLimitError
+        request = httpx.Request("POST", "http://fake-openai.local/v1/chat/completions")
+        response = httpx.Response(429, request=request, headers={"retry-after": "0.1"})
+        return RateLimitError("Rate limit reached (fake)", response=response, body=None)
+
+    def create(self, model=None, messages=None, **kwargs):
+        with self._lock:
+            self.calls += 1
+            rate_limited = self._random.random() < self.rate_limit_rate
+        time.sleep(self.latency)
+        if rate_limited:
+            raise self._rate_limit_error()
+
+        # The prompt embeds the input list as a Python literal after "Input texts:"
+        prompt = messages[-1]["content"]
+        body = prompt.split("Input texts:", 1)[1].split("Return format:", 1)[0].strip()
+        import ast
+        items = ast.literal_eval(body)
+        if self.max_items and len(items) > self.max_items:
+            return _FakeResponse("", finish_reason="length")
+        with self._lock:
+            kept = [item for item in items if self._random.random() >= self.drop_rate]
+        translations = {str(item["id"]): f"[zh] {item['text']}" for item in kept}
+        return _FakeResponse(json.dumps(translations, ensure_ascii=False))
+
+
+def benchmark_against_sequential(translate_fn, batches, max_in_flight=8,
+                                 requests_per_minute=None, tokens_per_minute=None):
+    """
+    Runs the same batches through the sequential path (one in flight) and the
+    concurrent scheduler, and prints the achieved throughput of each.
+    """
+    results = {}
+    for label, in_flight in [("sequential", 1), ("concurrent", max_in_flight)]:
+        start = time.perf_counter()
+        with TranslationScheduler(translate_fn, max_in_flight=in_flight,
+                                  requests_per_minute=requests_per_minute,
+                                  tokens_per_minute=tokens_per_minute,
+                                  base_backoff=0.1) as scheduler:
+            translated = scheduler.translate_all(batches)
+        elapsed = time.perf_counter() - start
+        segments = sum(len(t) for t in translated)
+        results[label] = {
+            "elapsed": elapsed,
+            "batches_per_second": len(batches) / elapsed,
+            "segments_per_second": segments / elapsed,
+            "requests": scheduler.stats["requests"],
+            "rate_limited": scheduler.stats["rate_limited"],
+            "retried_segments": scheduler.stats["retried_segments"],
+            "splits": scheduler.stats["splits"],
+        }
+        print(f"📊 {label:>10}: {elapsed:6.2f}s, {len(batches) / elapsed:6.2f} batches/s, "
+              f"{segments / elapsed:7.1f} segments/s, {scheduler.stats['rate_limited']} retries after 429, "
+              f"{scheduler.stats['splits']} splits, {scheduler.stats['retried_segments']} segments re-requested")
+    speedup = results["sequential"]["elapsed"] / results["concurrent"]["elapsed"]
+    print(f"🚀 Speedup: {speedup:.1f}x with {max_in_flight} batches in flight")
+    return results
+
+
+# --- Run the benchmark ---
+if __name__ == "__main__":
+    # Go through the importable module so exception classes match the ones main.py raises
+    import translation_scheduler
+    from main import translate_batch_with_openai
+
+    fake_client = translation_scheduler.FakeOpenAIClient(latency=0.3, rate_limit_rate=0.05, max_items=40,
+                                                         drop_rate=0.02, seed=1)
+    fake_batches = [
+        [{'text': f"Page {page} segment {i} of the magazine"} for i in range(50)]
+        for page in range(24)
+    ]
+    translation_scheduler.benchmark_against_sequential(
+        lambda batch: translate_batch_with_openai(batch, openai_client=fake_client, cache=False),
+        fake_batches,
+        max_in_flight=8,
+    )